@@ -7,6 +7,7 @@ from collections import namedtuple
 from operator import attrgetter
 from utils import ItemsCount
 import logging
+from log_queue import capped, VERBOSE
 logging.basicConfig(level=logging.INFO)
 
 SentenceInfo = namedtuple("SentenceInfo", ("sentence", "order", "rating",))
@@ -23,7 +24,7 @@ class BaseSummarizer(object):
 
     def _get_best_sentences(self, sentences, count, rating, *args, **kwargs):
         rate = rating
-        self.logger.info("Sentences are %s" % sentences)
+        self.logger.info("Sentences are %s", capped(sentences), extra=VERBOSE)
 
         infos = (SentenceInfo(s, o, rate(s, *args, **kwargs))
             for o, s in enumerate(sentences))
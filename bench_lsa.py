@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the vectorized LSA numeric core against the original
+per-cell Python loops. Run with
+
+    python ./bench_lsa.py
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import math
+import timeit
+import numpy
+from numpy.linalg import svd as singular_value_decomposition
+from lsa import (LsaSummarizer, compute_term_frequency, compute_ranks,
+                 batch_ranks)
+
+SHAPES = [(50, 20), (300, 120), (1000, 400)]
+BATCH = 16
+REPEAT = 3
+
+
+def loop_term_frequency(matrix, smooth=0.4):
+    """Original cell by cell TF smoothing"""
+    matrix = matrix.copy()
+    max_word_frequencies = numpy.max(matrix, axis=0)
+    rows, cols = matrix.shape
+    for row in range(rows):
+        for col in range(cols):
+            max_word_frequency = max_word_frequencies[col]
+            if max_word_frequency != 0:
+                frequency = matrix[row, col]/max_word_frequency
+                matrix[row, col] = smooth + (1.0 - smooth)*frequency
+    return matrix
+
+
+def loop_ranks(sigma, v_matrix):
+    """Original column by column rank computation"""
+    dimensions = max(LsaSummarizer.MIN_DIMENSIONS,
+        int(len(sigma)*LsaSummarizer.REDUCTION_RATIO))
+    powered_sigma = tuple(s**2 if i < dimensions else 0.0
+        for i, s in enumerate(sigma))
+    ranks = []
+    for column_vector in v_matrix.T:
+        rank = sum(s*v**2 for s, v in zip(powered_sigma, column_vector))
+        ranks.append(math.sqrt(rank))
+    return ranks
+
+
+def loop_pipeline(matrix):
+    u, sigma, v = singular_value_decomposition(loop_term_frequency(matrix), full_matrices=False)
+    return loop_ranks(sigma, v)
+
+
+def vector_pipeline(matrix):
+    u, sigma, v = singular_value_decomposition(compute_term_frequency(matrix), full_matrices=False)
+    return compute_ranks(sigma, v)
+
+
+def best_time(fn, *args):
+    return min(timeit.repeat(lambda: fn(*args), number=1, repeat=REPEAT))
+
+
+def main():
+    rng = numpy.random.RandomState(0)
+    for words, sentences in SHAPES:
+        matrix = rng.poisson(0.05, size=(words, sentences)).astype('float64')
+        expected = loop_pipeline(matrix)
+        actual = vector_pipeline(matrix)
+        assert numpy.allclose(expected, actual)
+        t_loop = best_time(loop_pipeline, matrix)
+        t_vec = best_time(vector_pipeline, matrix)
+        print("{}x{}: loops {:.4f}s vectorized {:.4f}s speedup {:.1f}x".format(
+            words, sentences, t_loop, t_vec, t_loop/t_vec))
+        batch = [rng.poisson(0.05, size=(words - i, sentences - i)).astype('float64')
+                 for i in range(BATCH)]
+        for m, ranks in zip(batch, batch_ranks(batch)):
+            assert numpy.allclose(vector_pipeline(m), ranks)
+        t_single = best_time(lambda: [vector_pipeline(m) for m in batch])
+        t_batch = best_time(batch_ranks, batch)
+        print("{}x{} batch of {}: one at a time {:.4f}s stacked {:.4f}s".format(
+            words, sentences, BATCH, t_single, t_batch))
+
+if __name__ == '__main__':
+    main()
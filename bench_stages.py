@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Per stage benchmark of the summary pipeline on synthetic channels.
+
+    python ./bench_stages.py --sizes 1000 10000 --output bench_results.json \
+        --baseline bench_baseline.json
+
+times fetching and paging, canonicalization, parsing, dictionary and
+matrix construction, SVD, ranking and formatting for the spaCy/LSA engine
+and the sparse TextRank ranking, plus both engines end to end. The parse
+time saved by the candidate pre-selection is reported as parse_saved.
+Results are written as JSON; when a baseline file is given any stage
+slower than the baseline by more than --tolerance is reported and the exit
+status is 1; a missing baseline file is only warned about.
+Use --save-baseline to record the current run as the baseline.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import sys
+import time
+from synthetic_channel import SyntheticChannel, ChannelHistory
+from interval_summarizer import TsSummarizer, message_records
+from engines import registry as engines
+from ts_config import CANDIDATE_LIMIT
+import candidates
+
+FORMAT_COUNT = 100
+
+
+class FakeResponse(object):
+    def __init__(self, body):
+        self.body = body
+
+
+class FakeChannels(object):
+    """In process stand-in for slacker's channels API"""
+    def __init__(self, history):
+        self.history_pages = history
+        self.calls = 0
+
+    def history(self, channel, oldest=None, latest=None, count=100):
+        self.calls += 1
+        return FakeResponse(self.history_pages.page(oldest, latest, count))
+
+
+class FakeSlack(object):
+    def __init__(self, msgs):
+        self.channels = FakeChannels(ChannelHistory(msgs))
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, stage, fn, *args, **kwargs):
+        start = time.time()
+        result = fn(*args, **kwargs)
+        self.timings[stage] = round(time.time() - start, 4)
+        return result
+
+
+def bench_size(size, users, engine_names):
+    from slack_summary import SlackRouter
+    timer = StageTimer()
+    channel = SyntheticChannel(users=users, seed=size)
+    msgs = channel.messages(size)
+    router = SlackRouter(test=True)
+    router.slack = FakeSlack(msgs)
+    oldest = u'{:.6f}'.format(channel.end - channel.days * 86400 - 1)
+    fetched, complete = timer('fetch', router._fetch_history, 'CBENCH', oldest, {})
+    assert len(fetched) == size
+    pages = router.slack.channels.calls
+    records = timer('canonicalize', message_records, fetched)
+    can_dict = dict((rec.text, rec) for rec in records)
+    result = {'messages': size, 'pages': pages, 'unique_texts': len(can_dict), 'stages': timer.timings}
+
+    if 'spacy' in engine_names:
+        import lsa
+        lsa_summ = lsa.LsaSummarizer(cache=False)
+        cand = [txt for (txt, rec) in can_dict.items() if rec.words > 3]
+        docs = timer('parse', lambda: list(lsa_summ.parse(cand)))
+        # Parsing only the pre-selected candidates, as the engines do
+        selected = timer('select', candidates.select, [can_dict[txt] for txt in cand], CANDIDATE_LIMIT)
+        timer('parse_selected', lambda: list(lsa_summ.parse([rec.text for rec in selected])))
+        result['candidates'] = len(selected)
+        result['parse_saved'] = round(timer.timings['parse'] - timer.timings['select'] - timer.timings['parse_selected'], 4)
+        spans = [max(doc.sents, key=lambda x: len(x)) for doc in docs]
+        users = dict((span.text, can_dict[txt].user) for (txt, span) in zip(cand, spans))
+        ctx = lsa.LsaContext(spans, users)
+        dictionary = timer('dictionary', lsa_summ._create_dictionary, ctx)
+        matrix = timer('matrix', lsa_summ._create_sparse_matrix, ctx, dictionary)
+        sigma, v = timer('svd', lsa_summ._singular_values, matrix)
+        timer('ranking', lsa_summ._compute_ranks, sigma, v)
+        summ = engines.get('spacy')()
+        summ.set_summarizer(lsa_summ)
+        summ.set_channel('CBENCH')
+        timer('spacy_summary', summ.summarize, fetched)
+
+    if 'gensim' in engine_names:
+        import textrank
+        texts = list(can_dict.keys())
+        timer('textrank', textrank.rank, texts, range(len(texts)))
+        summ = engines.get('gensim')()
+        summ.set_channel('CBENCH')
+        timer('gensim_summary', summ.summarize, fetched)
+
+    formatter = TsSummarizer()
+    formatter.set_channel('CBENCH')
+    timer('format', lambda: [formatter.tagged_sum(rec) for rec in records[:FORMAT_COUNT]])
+    return result
+
+
+def regressions(results, baseline, tolerance):
+    """(size, stage, seconds, baseline seconds) for stages slower than the baseline"""
+    found = []
+    for (size, result) in results.items():
+        base = baseline.get(size)
+        if not base:
+            continue
+        for (stage, seconds) in result['stages'].items():
+            before = base['stages'].get(stage)
+            if before and seconds > before * (1 + tolerance) and seconds - before > 0.01:
+                found.append((size, stage, seconds, before))
+    return sorted(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--engines', nargs='+', default=['spacy', 'gensim'])
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = bench_size(size, args.users, args.engines)
+        print(json.dumps({str(size): results[str(size)]}, sort_keys=True))
+    with open(args.output, 'w') as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    elif args.baseline and not os.path.exists(args.baseline):
+        print("No baseline at {}, not comparing; record one with --save-baseline".format(args.baseline),
+              file=sys.stderr)
+    elif args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        slower = regressions(results, baseline, args.tolerance)
+        for (size, stage, seconds, before) in slower:
+            print("REGRESSION {} messages, {}: {:.4f}s vs {:.4f}s".format(size, stage, seconds, before))
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
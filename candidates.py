@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap pre-selection of the messages worth parsing. Each message is scored
+by BM25 against the statistics of the channel history at hand (the sum of
+its terms' weights, so rare, specific words count and chatter does not),
+and a heap of at most K entries keeps the best while the scores stream by.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from bisect import bisect_left
+from collections import Counter
+import heapq
+import math
+
+from textrank import Tokenizer, K1, B
+from ts_config import CANDIDATE_LIMIT
+
+
+def bm25_scores(records, tokenize=None):
+    """Informativeness of each record's text against all of the records"""
+    tokenize = tokenize or Tokenizer()
+    terms = [Counter(tokenize(rec.text)) for rec in records]
+    df = Counter()
+    for counts in terms:
+        df.update(counts.keys())
+    docs = len(terms)
+    avgdl = sum(sum(counts.values()) for counts in terms) / float(docs or 1) or 1.0
+    # Terms in half of the messages or more carry nothing
+    idf = dict((term, max(math.log((docs - n + 0.5) / (n + 0.5)), 0.0)) for (term, n) in df.items())
+    scores = []
+    for counts in terms:
+        norm = K1 * (1 - B + B * sum(counts.values()) / avgdl)
+        scores.append(sum(idf[term] * f * (K1 + 1) / (f + norm) for (term, f) in counts.items()))
+    return scores
+
+
+def top_k(scores, k, among=None):
+    """
+    Indices of the `k` best `scores` (of the indices in `among`, default
+    all) in increasing order; ties keep the later index.
+    """
+    heap = []
+    for i in (range(len(scores)) if among is None else among):
+        if len(heap) < k:
+            heapq.heappush(heap, (scores[i], i))
+        elif (scores[i], i) > heap[0]:
+            heapq.heapreplace(heap, (scores[i], i))
+    return sorted(i for (score, i) in heap)
+
+
+def select(records, k=CANDIDATE_LIMIT, tokenize=None):
+    """The `k` most informative records in their original order, all of them without `k`"""
+    records = list(records)
+    if not k or len(records) <= k:
+        return records
+    return [records[i] for i in top_k(bm25_scores(records, tokenize), k)]
+
+
+def select_windows(records, starts, k=CANDIDATE_LIMIT, tokenize=None):
+    """
+    `select` for windows ending together: `records` are sorted by time and
+    each window starts at one of `starts`. Every window keeps its own `k`
+    best, so short recent windows are not crowded out by the long ones.
+    """
+    records = list(records)
+    if not k or len(records) <= k:
+        return records
+    scores = bm25_scores(records, tokenize)
+    stamps = [rec.ts for rec in records]
+    keep = set()
+    for start in starts:
+        keep.update(top_k(scores, k, range(bisect_left(stamps, start), len(records))))
+    return [records[i] for i in sorted(keep)]
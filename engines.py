@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy registry of the summarization engines. Nothing NLP related is
+imported until an engine is first asked for (or explicitly warmed up),
+so the web tier, health checks and test collection start quickly.
+
+    python ./engines.py
+
+prints how long the web tier takes to import and each engine to load.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EngineRegistry(object):
+    """
+    Maps an engine name to `module.attr`. Plain entries resolve to the
+    attribute (a summarizer class); `shared` entries are constructed once
+    and the instance is handed to every caller.
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._engines = {}
+        self._lock = threading.RLock()
+        self.timings = {}
+
+    def register(self, name, module, attr, shared=False):
+        self._specs[name] = (module, attr, shared)
+
+    def names(self):
+        return sorted(self._specs.keys())
+
+    def loaded(self, name):
+        return name in self._engines
+
+    def get(self, name):
+        engine = self._engines.get(name)
+        if engine is not None:
+            return engine
+        with self._lock:
+            if name not in self._engines:
+                module, attr, shared = self._specs[name]
+                start = time.time()
+                engine = getattr(importlib.import_module(module), attr)
+                if shared:
+                    engine = engine()
+                self.timings[name] = round(time.time() - start, 3)
+                logger.info(u'Loaded engine %s in %ss', name, self.timings[name])
+                self._engines[name] = engine
+            return self._engines[name]
+
+    def warm_up(self, names=None):
+        for name in names or self.names():
+            self.get(name)
+        return self.report()
+
+    def report(self):
+        """Seconds each loaded engine took to import and construct"""
+        return dict(self.timings)
+
+
+registry = EngineRegistry()
+registry.register('lsa', 'lsa', 'LsaSummarizer', shared=True)
+registry.register('spacy', 'sp_summarizer', 'SpacyTsSummarizer')
+registry.register('gensim', 'ts_summarizer', 'TextRankTsSummarizer')
+registry.register('simple', 'interval_summarizer', 'SimpleTsSummarizer')
+
+
+def main():
+    start = time.time()
+    import main
+    print("import main: {:.3f}s".format(time.time() - start))
+    for (name, seconds) in sorted(registry.warm_up().items()):
+        print("engine {}: {:.3f}s".format(name, seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Slack Web API's `channels.history`, for load tests
+that must not touch real Slack.
+
+    python ./fake_slack.py --port 5005 --synthetic 50000 --latency 0.05 \
+        --rate-limit 0.01
+
+serves a synthetic channel (or the `data/*.json` fixtures, shifted so the
+newest message is recent) with Slack's paging (`oldest`, `latest`,
+`count`, `has_more`). Every response is delayed by `--latency` seconds
+plus up to `--jitter`, and a `--rate-limit` fraction of requests is
+answered with HTTP 429 and a Retry-After header. Point the app at it by
+setting SLACK_API_URL in ts_config.py to http://localhost:5005/api/
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import glob
+import io
+import json
+import logging
+import random
+import threading
+import time
+try:
+    import BaseHTTPServer as httpserver
+    import SocketServer as socketserver
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    import http.server as httpserver
+    import socketserver
+    from urllib.parse import urlparse, parse_qs
+from synthetic_channel import SyntheticChannel, ChannelHistory
+
+logger = logging.getLogger(__name__)
+
+
+def load_fixtures(pattern='./data/*.json', rebase=True):
+    """
+    Messages of every fixture file that parses as JSON. With `rebase` the
+    timestamps are shifted so the newest message was posted just now.
+    """
+    msgs = []
+    for fname in sorted(glob.glob(pattern)):
+        try:
+            with io.open(fname, encoding='utf-8') as fh:
+                data = json.load(fh)
+        except ValueError:
+            logger.warn(u'Skipping %s, it is not JSON', fname)
+            continue
+        msgs += data['messages'] if isinstance(data, dict) else data
+    seen = set()
+    msgs = [msg for msg in msgs if msg['ts'] not in seen and not seen.add(msg['ts'])]
+    if rebase and msgs:
+        shift = time.time() - max(float(msg['ts']) for msg in msgs)
+        msgs = [dict(msg, ts=u'{:.6f}'.format(float(msg['ts']) + shift)) for msg in msgs]
+    return msgs
+
+
+class FakeSlackHandler(httpserver.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self._answer(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers['Content-Length'] or 0)
+        params = parse_qs(url.query)
+        params.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+        self._answer(url.path, params)
+
+    def _answer(self, path, params):
+        server = self.server
+        server.count_request()
+        delay = server.latency + random.random() * server.jitter
+        if delay:
+            time.sleep(delay)
+        if random.random() < server.rate_limit:
+            server.count_limited()
+            return self._send(429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': '1'})
+        method = path.rstrip('/').split('/')[-1]
+        if method != 'channels.history':
+            return self._send(200, {'ok': False, 'error': 'unknown_method'})
+        get = lambda key: params[key][0] if params.get(key) and params[key][0] else None
+        body = server.history.page(get('oldest'), get('latest'), get('count') or 100)
+        self._send(200, body)
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeSlackServer(socketserver.ThreadingMixIn, httpserver.HTTPServer):
+    """Every channel id is served from the same message history"""
+    daemon_threads = True
+
+    def __init__(self, address, msgs, latency=0.0, jitter=0.0, rate_limit=0.0):
+        httpserver.HTTPServer.__init__(self, address, FakeSlackHandler)
+        self.history = ChannelHistory(msgs)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_limited(self):
+        with self._lock:
+            self.limited += 1
+
+    @property
+    def api_url(self):
+        return 'http://{}:{}/api/'.format(*self.server_address[:2])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='serve this many synthetic messages instead of the fixtures')
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.synthetic:
+        msgs = SyntheticChannel(users=args.users, days=args.days).messages(args.synthetic)
+    else:
+        msgs = load_fixtures()
+    server = FakeSlackServer(('127.0.0.1', args.port), msgs, args.latency, args.jitter, args.rate_limit)
+    logger.info(u'Serving %s messages at %s', len(msgs), server.api_url)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn settings for serving with several workers. The app and its NLP
+model are loaded and warmed up once in the master before the workers are
+forked, so the model's pages are shared copy-on-write between them.
+
+    gunicorn -c gunicorn_conf.py main:app
+"""
+import os
+from ts_config import SERVE_WORKERS, SERVE_TIMEOUT
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 5000))
+workers = SERVE_WORKERS
+timeout = SERVE_TIMEOUT
+preload_app = True
+
+
+def when_ready(server):
+    """Runs in the master after the app is preloaded and before any fork"""
+    import main
+    main.warm_up()
+    server.log.info('Master warmed up %s', main.process_report(main.started_at))
+
+
+def post_worker_init(worker):
+    import main
+    worker.log.info('Worker ready %s', main.process_report(main.started_at))
@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
-from collections import namedtuple
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
 from datetime import (timedelta, datetime)
+from itertools import islice
+from operator import attrgetter
+import calendar
 import re
+import time
 import logging
-import logging.handlers
+import log_queue
 import sys
 import json
 import io
-from ts_config import TS_DEBUG, TS_LOG
 import glob
 from utils import get_msg_text
 from slacker import Slacker
 from config import keys
+import metrics
+from near_dupes import exact
+from ts_config import CANDIDATE_LIMIT
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,14 +33,10 @@ class TsSummarizer(object):
         self.logger = logging.getLogger(__name__)
         self.channel = None
         self.slack = None
-        log_level = logging.DEBUG if TS_DEBUG else logging.INFO
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh = logging.handlers.RotatingFileHandler('./interval_'+TS_LOG, mode='a', encoding='utf-8', maxBytes=1000000, backupCount=5)
-        fh.setLevel(log_level)
-        fh.setFormatter(formatter)
+        self.progress = None
+        self.candidate_limit = CANDIDATE_LIMIT
+        log_queue.configure()
         self.logger = logging.getLogger('interval_summarizer')
-        self.logger.handlers = []
-        self.logger.addHandler(fh)
 
     def summarize(self, messages, range_spec=None):
         """ Produce the input """
@@ -43,27 +46,265 @@ class TsSummarizer(object):
         """The interval summaries are joined."""
         return '\n'.join(self.summarize(messages, range_spec=range_spec))
 
+    def summarize_windows(self, msgs, specs, end=None):
+        """
+        One summary per range spec in `specs`, each covering the spec's
+        duration up to `end` (default now). The messages are indexed once
+        and every window is a view of that index.
+        """
+        index = msgs if isinstance(msgs, TimeIndex) else TimeIndex(msgs)
+        end = time.time() if end is None else end
+        windows = [index.last_window(spec, end) for spec in specs]
+        return u'\n'.join(self._section(spec, window, self.summarize(window, dict(spec, txt=u'')).strip() if len(window) else u'')
+                           for (spec, window) in zip(specs, windows))
+
+    def _section(self, spec, window, summ):
+        return (spec['txt'] if 'txt' in spec else interval_text(spec)) + (summ if len(window) else u'No messages.')
+
+    def select(self, msgs, range_spec=None):
+        """
+        Records of `msgs` (messages, records or a `TimeIndex`) falling in the
+        `range_spec` window, all of them without a spec.
+        """
+        if isinstance(msgs, RecordWindow):
+            return msgs
+        if isinstance(msgs, TimeIndex):
+            return msgs.spec_window(range_spec) if range_spec else msgs.window()
+        if range_spec:
+            return TimeIndex(msgs).spec_window(range_spec)
+        return message_records(msgs)
+
     def set_channel(self, channel):
         self.channel = channel
 
     def set_slack(self, conn):
         self.slack = conn
 
+    def set_progress(self, callback):
+        """`callback` is handed the cheap first stage summary before the NLP stage runs"""
+        self.progress = callback
+
+    def set_candidate_limit(self, limit):
+        """At most `limit` messages are parsed and ranked, None for all"""
+        self.candidate_limit = limit
+
+    def report_progress(self, summ):
+        if self.progress:
+            self.progress(summ)
+
+    def _simple_sum(self, records, size):
+        """The `size` longest messages in time order"""
+        top_recs = sorted(records, key=attrgetter('words'), reverse=True)[:size]
+        with metrics.timed('format'):
+            return u'\n'.join([self.tagged_sum(rec) for rec in sorted(top_recs, key=attrgetter('ts'))])
+
     def tagged_sum(self, msg):
-        user = "USER UNKNOWN"
-        if 'user' in msg:
-            user = msg['user']
-        elif 'bot_id' in msg:
-            user = msg['bot_id']
-        elif 'username' in msg and msg['username'] == u'bot':
-            user = 'bot'
-        split_text = get_msg_text(msg).split()
+        return self._tagged_sum(msg if isinstance(msg, MessageRecord) else MessageRecord(msg))
+
+    def _tagged_sum(self, rec):
+        split_text = rec.raw.split()
         text = u' '.join(split_text[:30])+u'...' if len(split_text) > 30 else u' '.join(split_text)
         if self.channel:
-            link = TsSummarizer.archive_link.format(self.channel, re.sub(r'\.',u'',msg['ts']))
+            link = TsSummarizer.archive_link.format(self.channel, rec.link_id)
             text = u'<'+link+'|'+text+'>'
-        return u'@{} <@{}>: {}'.format(ts_to_time(msg['ts']).strftime("%a-%b-%-m-%Y %H:%M:%S"), user,  text)
-    
+        if rec.similar:
+            text += u' (+{} similar)'.format(rec.similar)
+        return u'@{} <@{}>: {}'.format(rec.time.strftime("%a-%b-%-m-%Y %H:%M:%S"), rec.author,  text)
+
+
+class SimpleTsSummarizer(TsSummarizer):
+    """The heuristic summary: the longest messages of the range in time order"""
+
+    def summarize(self, msgs, range_spec=None):
+        if not msgs or len(msgs) == 0:
+            return u"\n Unable to form summary here.\n"
+        txt = range_spec['txt'] if range_spec and 'txt' in range_spec else u'Summary is'
+        size = range_spec['size'] if range_spec and 'size' in range_spec else 3
+        return txt + u' ' + self._simple_sum(exact(self.select(msgs, range_spec)), size)
+
+
+class MessageRecord(object):
+    """
+    A Slack message normalized once: float `ts` (and the original `ts_id`
+    string), UTC `time`, the poster's `user` id ('' if none) and `author` as
+    displayed, the `raw` text, its canonical form `text` with `words`
+    words, the `link_id` of its archive permalink and the number of near
+    duplicates it stands for, `similar`.
+    """
+    __slots__ = ('msg', 'ts_id', 'ts', 'time', 'user', 'author', 'raw', 'text', 'words', 'link_id', 'similar')
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.ts_id = msg['ts']
+        self.ts = float(self.ts_id)
+        self.time = datetime.utcfromtimestamp(int(self.ts))
+        self.user = msg['user'] if 'user' in msg else u''
+        if self.user:
+            self.author = self.user
+        elif 'bot_id' in msg:
+            self.author = msg['bot_id']
+        elif 'username' in msg and msg['username'] == u'bot':
+            self.author = 'bot'
+        else:
+            self.author = "USER UNKNOWN"
+        self.raw = get_msg_text(msg)
+        self.text = canonicalize(self.raw)
+        self.words = len(self.text.split())
+        self.link_id = self.ts_id.replace(u'.', u'')
+        self.similar = 0
+
+    def folded(self, similar):
+        """A copy standing for itself and `similar` near duplicates"""
+        rec = MessageRecord.__new__(MessageRecord)
+        for slot in MessageRecord.__slots__:
+            setattr(rec, slot, getattr(self, slot))
+        rec.similar = similar
+        return rec
+
+    def __getitem__(self, key):
+        return self.msg[key]
+
+    def __repr__(self):
+        return str('MessageRecord({}, {} words)'.format(self.ts_id, self.words))
+
+    def __contains__(self, key):
+        return key in self.msg
+
+
+class TimeIndex(object):
+    """
+    Message records sorted by their float timestamps. Windows are found by
+    bisection and returned as views over the shared records, so one index
+    serves every interval of a request.
+    """
+
+    def __init__(self, msgs):
+        self.records = sorted(message_records(msgs), key=attrgetter('ts'))
+        self.ts = [rec.ts for rec in self.records]
+
+    def __len__(self):
+        return len(self.records)
+
+    def window(self, start=None, end=None):
+        """Records with start <= ts < end, epoch seconds, either bound optional"""
+        lo = bisect_left(self.ts, start) if start is not None else 0
+        hi = bisect_left(self.ts, end) if end is not None else len(self.ts)
+        return RecordWindow(self.records, lo, max(lo, hi))
+
+    def spec_window(self, range_spec):
+        """
+        The window of a range spec: its duration from `start` ("%B %d %Y",
+        UTC) or else from the earliest message.
+        """
+        if 'start' in range_spec:
+            start = calendar.timegm(datetime.strptime(range_spec['start'], "%B %d %Y").timetuple())
+        elif self.ts:
+            start = self.ts[0]
+        else:
+            return RecordWindow(self.records, 0, 0)
+        return self.window(start, start + tspec_to_delta(**range_spec).total_seconds())
+
+    def last_window(self, range_spec, end=None):
+        """The records of the range spec's duration up to `end` (default now)"""
+        end = time.time() if end is None else end
+        return self.window(end - tspec_to_delta(**range_spec).total_seconds(), end)
+
+
+class RecordWindow(object):
+    """Read only view of records[lo:hi] that does not copy the list"""
+    __slots__ = ('records', 'lo', 'hi')
+
+    def __init__(self, records, lo, hi):
+        self.records = records
+        self.lo = lo
+        self.hi = hi
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def __iter__(self):
+        return islice(self.records, self.lo, self.hi)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.records[self.lo + j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.records[self.lo + i]
+
+
+class SourceIndex(object):
+    """
+    Maps summary sentences back to the records they came from. Texts and
+    their aliases (e.g. parsed sentence spans) are found by exact lookup;
+    other sentences of more than `min_words` words are searched for in the
+    joined record texts, whose offsets are recorded at join time, in one
+    pass of a single pattern matching all of them.
+    """
+
+    def __init__(self, records=(), min_words=5):
+        self.records = list(records)
+        self.min_words = min_words
+        self.exact = dict((rec.text, rec) for rec in self.records)
+        self._joined = None
+        self._starts = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, text):
+        return text in self.exact
+
+    def __getitem__(self, text):
+        return self.exact[text]
+
+    def alias(self, text, rec):
+        self.exact[text] = rec
+
+    def join(self):
+        """The record texts joined by spaces and the offset where each starts"""
+        if self._joined is None:
+            starts = []
+            pos = 0
+            for rec in self.records:
+                starts.append(pos)
+                pos += len(rec.text) + 1
+            self._joined = u' '.join(rec.text for rec in self.records)
+            self._starts = starts
+        return self._joined, self._starts
+
+    def locate(self, sentences, limit=None):
+        """
+        Records of the `sentences` without repeats: exact matches first,
+        then records holding or covered by a searched sentence while fewer
+        than `limit` are found.
+        """
+        found = []
+        missing = []
+        for ss in sentences:
+            if ss in self.exact:
+                found.append(self.exact[ss])
+            elif len(ss.split()) > self.min_words:
+                missing.append(ss)
+        if missing and self.records:
+            joined, starts = self.join()
+            pattern = re.compile(u'|'.join(re.escape(ss) for ss in sorted(set(missing), key=len, reverse=True)))
+            for match in pattern.finditer(joined):
+                if limit is not None and len(set(found)) >= limit:
+                    break
+                # Every record overlapping the match
+                lo = bisect_right(starts, match.start()) - 1
+                hi = bisect_left(starts, match.end())
+                found.extend(self.records[lo:hi])
+        return list(OrderedDict.fromkeys(found))
+
+
+def message_records(msgs):
+    """Records of the messages, passing records through"""
+    return [msg if isinstance(msg, MessageRecord) else MessageRecord(msg) for msg in msgs]
+
 
 def ts_to_time(slack_ts):
     """
@@ -74,12 +315,18 @@ def ts_to_time(slack_ts):
     """
     return datetime.utcfromtimestamp(long(IntervalSpec.slk_ts.search(slack_ts).group('epoch')))
 
+def interval_text(spec):
+    """Heading of a range spec's summary, e.g. "Summary for last 12 hours:" """
+    for unit in ('weeks', 'days', 'hours', 'minutes', 'seconds'):
+        if spec.get(unit):
+            return u"Summary for last {} {}:\n".format(spec[unit], unit if spec[unit] != 1 else unit[:-1])
+    return u"Summary:\n"
+
 def tspec_to_delta(seconds=0, minutes= 0, hours= 0, days= 0, weeks=0, **args):
     return timedelta(seconds= seconds, minutes= minutes, hours= hours, days= days, weeks=weeks)
 
 def canonicalize(txt):
     """Filter and change text to sentece form"""
-    ntxt = TsSummarizer.flrg.sub(u'', txt)
-    return ntxt.strip() if re.match(r'.*[\.\?\!]\s*$', ntxt) else u'{}.'.format(ntxt.strip())
-    #return ntxt if re.match(r'.*[\.\?]$', ntxt) else u'{}.'.format(ntxt)
-
+    # One pass over the markup, only the last character decides the ending
+    ntxt = TsSummarizer.flrg.sub(u'', txt).strip()
+    return ntxt if ntxt[-1:] in (u'?', u'!') else u'{}.'.format(ntxt)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded pool of worker threads that computes summaries outside of the
+slash command request and posts them back to Slack's `response_url`.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import json
+import logging
+import threading
+import requests
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(__name__)
+
+
+def post_response(response_url, text, replace_original=False, timeout=10):
+    """Deliver a message to a slash command's response_url"""
+    payload = {'text': text}
+    if replace_original:
+        payload['replace_original'] = True
+    resp = requests.post(response_url, data=json.dumps(payload),
+                         headers={'Content-Type': 'application/json'}, timeout=timeout)
+    logger.debug(u'Posted %s characters to %s, status %s', len(text), response_url, resp.status_code)
+    return resp
+
+
+class JobPool(object):
+    """
+    `workers` threads take jobs from a queue holding at most `queue_depth`
+    entries. A job is a callable returning the text to post. It is handed a
+    `progress` callable through which it may post a preliminary text that
+    the final one later replaces. If a job runs longer than `timeout`
+    seconds the user is told so (unless a preliminary text is already
+    showing) and the result, when it eventually arrives, is dropped.
+
+    A late job cannot be stopped, its thread runs on after the worker has
+    moved on. At most `runners` (default twice `workers`) job threads are
+    alive at once; while all are busy the workers wait, jobs stay queued
+    and `submit` rejects jobs once the queue is full. The summary planner
+    runs its engine on one more thread per job, see `planner.run`.
+    """
+    timeout_text = u'Sorry, the summary is taking too long. Try a shorter interval.'
+    error_text = u'Sorry, unable to form a summary.'
+
+    def __init__(self, workers, queue_depth, timeout, runners=None):
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.runners = threading.BoundedSemaphore(runners or 2 * workers)
+        self.threads = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name='summary-worker-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.threads.append(worker)
+
+    def submit(self, job, response_url):
+        """Queue the job, returns False when the queue is full"""
+        try:
+            self.queue.put_nowait((job, response_url))
+        except queue.Full:
+            logger.warn(u'Summary queue is full, rejecting job for %s', response_url)
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            job, response_url = self.queue.get()
+            try:
+                self._run(job, response_url)
+            except Exception:
+                logger.exception(u'Unable to deliver summary to %s', response_url)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, job, response_url):
+        result = {}
+        lock = threading.Lock()
+
+        def progress(text):
+            with lock:
+                if 'done' not in result:
+                    try:
+                        post_response(response_url, text, replace_original=True)
+                        result['partial'] = True
+                    except Exception:
+                        logger.exception(u'Unable to deliver preliminary summary')
+
+        def target():
+            try:
+                result['text'] = job(progress)
+            except Exception:
+                logger.exception(u'Summary job failed')
+            finally:
+                self.runners.release()
+
+        runner = threading.Thread(target=target)
+        runner.daemon = True
+        self.runners.acquire()
+        try:
+            runner.start()
+        except Exception:
+            self.runners.release()
+            raise
+        runner.join(self.timeout)
+        with lock:
+            result['done'] = True
+            # A preliminary summary already showing beats an apology
+            fallback = None if 'partial' in result else self.error_text
+            if runner.is_alive():
+                logger.warn(u'Summary job exceeded %s seconds', self.timeout)
+                text = fallback and self.timeout_text
+            else:
+                text = result.get('text', fallback)
+            if text:
+                post_response(response_url, text, replace_original=True)
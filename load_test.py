@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Load generator for the /slack endpoint.
+
+    python ./load_test.py --requests 200 --concurrency 8
+
+drives `main.app` in process through Flask's test client, or a running
+server with --url http://localhost:5000/slack. Commands are drawn from
+--commands. It reports p50/p95/p99 latency, throughput and error rate;
+pair it with fake_slack.py so no request reaches real Slack.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+
+COMMANDS = ['5 days', '2 days', '12 hours', '30 minutes', '1 week', '2 days gensim']
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100 * len(values)))
+    return values[min(max(rank - 1, 0), len(values) - 1)]
+
+
+def summarize_run(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    total = len(latencies)
+    return {'requests': total, 'errors': errors,
+            'error_rate': round(errors / total, 4) if total else 0.0,
+            'throughput': round(total / elapsed, 2) if elapsed else None,
+            'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99), 'elapsed': round(elapsed, 3)}
+
+
+def http_sender(url):
+    import requests
+    session = requests.Session()
+    def send(form):
+        return session.post(url, data=form).status_code
+    return send
+
+
+def app_sender():
+    import main
+    main.app.config['TESTING'] = True
+    client = main.app.test_client()
+    def send(form):
+        return client.post('/slack', data=form).status_code
+    return send
+
+
+def run(send_factory, total, concurrency, channel, commands, seed=0):
+    rng = random.Random(seed)
+    forms = [{'channel_id': channel, 'channel_name': channel,
+              'user_id': 'U{:08d}'.format(i % 50), 'user_name': 'load{}'.format(i % 50),
+              'text': rng.choice(commands)} for i in range(total)]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    todo = iter(forms)
+
+    def worker():
+        send = send_factory()
+        while True:
+            with lock:
+                form = next(todo, None)
+            if form is None:
+                return
+            start = time.time()
+            try:
+                ok = send(form) == 200
+            except Exception:
+                ok = False
+            latency = time.time() - start
+            with lock:
+                latencies.append(round(latency, 4))
+                if not ok:
+                    errors[0] += 1
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize_run(latencies, errors[0], time.time() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default=None, help='POST to a running server instead of main.app')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--channel', default='CLOADTEST')
+    parser.add_argument('--commands', nargs='+', default=COMMANDS)
+    args = parser.parse_args(argv)
+    factory = (lambda: http_sender(args.url)) if args.url else app_sender
+    report = run(factory, args.requests, args.concurrency, args.channel, args.commands)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Process wide logging set up once by `configure()`. Request threads only
+put records on a bounded queue; a background thread formats them and
+writes the log files, so formatting and disk writes stay off the request
+path. Records are dropped rather than blocking when the queue is full.
+
+Large payloads are wrapped in `capped(...)`, which is only rendered by the
+writer thread and then to at most LOG_PAYLOAD_CHARS characters. Records
+logged with `extra=VERBOSE`, and DEBUG records, are kept at the rate
+LOG_VERBOSE_SAMPLE.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import atexit
+import logging
+import logging.handlers
+import os
+import random
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from compat import PY3, string_types, unicode
+from ts_config import (DEBUG, LOG_FILE, TS_DEBUG, TS_LOG, LOG_QUEUE_SIZE,
+                       LOG_PAYLOAD_CHARS, LOG_VERBOSE_SAMPLE)
+
+# Log file of each named logger and whether it logs at DEBUG level
+LOG_FILES = {
+    'slack_summary': ('./slack_summary_' + LOG_FILE, DEBUG),
+    'interval_summarizer': ('./interval_' + TS_LOG, TS_DEBUG),
+    'sp_summarizer': ('./spacy_' + TS_LOG, TS_DEBUG),
+    'ts_summarizer': ('./text_rank_' + TS_LOG, TS_DEBUG),
+}
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+VERBOSE = {'verbose': True}
+
+
+class Capped(object):
+    """Renders `obj` lazily and to at most `limit` characters"""
+    __slots__ = ('obj', 'limit')
+
+    def __init__(self, obj, limit=None):
+        self.obj = obj
+        self.limit = limit or LOG_PAYLOAD_CHARS
+
+    def __unicode__(self):
+        obj = self.obj
+        if isinstance(obj, string_types) or not hasattr(obj, '__iter__'):
+            text = obj if isinstance(obj, unicode) else unicode(obj)
+        else:
+            # Only as many items as fit are rendered
+            parts = [u'[{} items]'.format(len(obj))] if hasattr(obj, '__len__') else []
+            size = 0
+            for item in (obj.items() if isinstance(obj, dict) else obj):
+                if size > self.limit:
+                    parts.append(u'...')
+                    break
+                parts.append(unicode(item))
+                size += len(parts[-1]) + 1
+            text = u' '.join(parts)
+        return text if len(text) <= self.limit else text[:self.limit] + u'...'
+
+    if PY3:
+        __str__ = __unicode__
+    else:
+        def __str__(self):
+            return self.__unicode__().encode('utf-8')
+
+
+def capped(obj, limit=None):
+    return Capped(obj, limit)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` fraction of DEBUG and VERBOSE records, all others pass"""
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG and not getattr(record, 'verbose', False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue for a `QueueListener` (not in Python 2's logging)"""
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.queue = records
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Tracebacks cannot cross to the writer thread unrendered
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        _ensure_listener()
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Background thread writing queued records. Records of the named loggers
+    in `routes` go to their handler, every record goes to the `handlers`.
+    """
+    _stop = object()
+
+    def __init__(self, records, handlers, routes):
+        self.queue = records
+        self.handlers = handlers
+        self.routes = routes
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread and self._thread.is_alive():
+            self.queue.put(QueueListener._stop)
+            self._thread.join()
+        self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        route = self.routes.get(record.name)
+        if route and record.levelno >= route.level:
+            route.handle(record)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is QueueListener._stop:
+                return
+            try:
+                self.handle(record)
+            except Exception:
+                pass
+
+
+_lock = threading.RLock()
+_handler = None
+_listener = None
+_pid = None
+
+
+def configure():
+    """
+    Route all logging through the queue. Safe to call any number of times;
+    only the first call in a process does anything.
+    """
+    global _handler, _listener, _pid
+    with _lock:
+        if _handler is not None:
+            return _handler
+        root = logging.getLogger()
+        formatter = logging.Formatter(FORMAT)
+        routes = {}
+        for (name, (fname, debug)) in LOG_FILES.items():
+            fh = logging.handlers.RotatingFileHandler(fname, mode='a', encoding='utf-8',
+                                                      maxBytes=1000000, backupCount=5)
+            fh.setLevel(logging.DEBUG if debug else logging.INFO)
+            fh.setFormatter(formatter)
+            routes[name] = fh
+        # Console handlers already on the root move behind the queue
+        consoles = list(root.handlers)
+        _handler = QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _handler.addFilter(SamplingFilter(LOG_VERBOSE_SAMPLE))
+        _listener = QueueListener(_handler.queue, consoles, routes)
+        root.handlers = [_handler]
+        logging.getLogger('slack_summary').setLevel(logging.DEBUG if DEBUG else logging.INFO)
+        _pid = os.getpid()
+        _listener.start()
+        atexit.register(shutdown)
+        return _handler
+
+
+def _ensure_listener():
+    """A forked child (e.g. a gunicorn worker) needs its own writer thread"""
+    global _pid
+    if _pid == os.getpid() or _listener is None:
+        return
+    with _lock:
+        if _pid != os.getpid():
+            _handler.queue = _listener.queue = queue.Queue(LOG_QUEUE_SIZE)
+            _pid = os.getpid()
+            _listener.start()
+
+
+def shutdown():
+    """Write out the records still queued"""
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
@@ -3,8 +3,8 @@
 from __future__ import absolute_import
 from __future__ import division, print_function, unicode_literals
 
-import math
-
+from collections import namedtuple
+import threading
 from warnings import warn
 
 try:
@@ -16,24 +16,56 @@ try:
     from numpy.linalg import svd as singular_value_decomposition
 except ImportError:
     singular_value_decomposition = None
+
+try:
+    from scipy.sparse import coo_matrix, diags
+    from scipy.sparse.linalg import svds as truncated_svd, LinearOperator
+except ImportError:
+    coo_matrix = diags = truncated_svd = LinearOperator = None
 from base_summarizer import BaseSummarizer
+from compat import string_types
+from ts_config import (PARSE_BATCH_SIZE, PARSE_WORKERS, PARSE_MIN_BATCH,
+                       PARSE_CACHE_SIZE, PARSE_CACHE_DIR, PARSE_CACHE_BYTES)
+from parse_cache import ParseCache
+import metrics
+from log_queue import capped, VERBOSE
 import spacy.en
+from spacy.tokens.doc import Doc
 from spacy.parts_of_speech import VERB, NOUN, PROPN, PRON, PUNCT
 from spacy.en import STOPWORDS
 import logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Per call state, kept off the summarizer so one instance can serve many threads
+LsaContext = namedtuple("LsaContext", ("sentences", "user_dict",))
+
 class LsaSummarizer(BaseSummarizer):
     MIN_DIMENSIONS = 3
     REDUCTION_RATIO = 1/1
+    # Matrices with at most this many sentences use the full dense SVD
+    DENSE_LIMIT = 500
+    # Number of singular triplets computed for larger matrices
+    MAX_DIMENSIONS = 100
     _stop_words = frozenset()
     
 
-    def __init__(self, ):
+    def __init__(self, dtype='float64', max_dimensions=None, batch_size=PARSE_BATCH_SIZE,
+                 workers=PARSE_WORKERS, min_batch=PARSE_MIN_BATCH, cache=True):
         BaseSummarizer.__init__(self, )
         self.nlp = spacy.en.English(entity=False, matcher=False)
-        self.nlp_doc = None
+        # The pipeline and its string store are not safe to share between
+        # threads, everything after parsing is
+        self._nlp_lock = threading.RLock()
+        self.dtype = dtype
+        self.max_dimensions = max_dimensions or LsaSummarizer.MAX_DIMENSIONS
+        self.batch_size = batch_size
+        self.workers = workers
+        self.min_batch = min_batch
+        self.cache = None
+        if cache:
+            self.cache = ParseCache(PARSE_CACHE_SIZE, PARSE_CACHE_DIR, PARSE_CACHE_BYTES,
+                                    dumps=lambda doc: doc.to_bytes(), loads=self._load_doc)
 
     @property
     def stop_words(self):
@@ -43,26 +75,100 @@ class LsaSummarizer(BaseSummarizer):
     def stop_words(self, words):
         self._stop_words = frozenset(map(self.normalize_word, words))
 
+    def parse(self, texts, keys=None):
+        """
+        Parse each text once, yielding the docs in order. When `keys`
+        (see `parse_cache.message_key`) are given, cached parses are reused
+        and only the misses are parsed and then stored.
+        """
+        texts = list(texts)
+        if keys is None or self.cache is None:
+            for doc in self._parse(texts):
+                yield doc
+            return
+        docs = [self.cache.get(key) for key in keys]
+        missing = [i for (i, doc) in enumerate(docs) if doc is None]
+        for (i, doc) in zip(missing, self._parse([texts[i] for i in missing])):
+            self.cache.put(keys[i], doc)
+            docs[i] = doc
+        logger.info("Parse cache %s", self.cache.stats())
+        for doc in docs:
+            yield doc
+
+    def _parse(self, texts):
+        """
+        Large inputs are streamed through the pipeline's `pipe` in batches
+        of `batch_size` on `workers` threads; inputs smaller than `min_batch`
+        are parsed one at a time since the batching overhead would dominate.
+        """
+        with self._nlp_lock, metrics.timed('parse'):
+            if len(texts) < self.min_batch or self.workers < 2 or not hasattr(self.nlp, 'pipe'):
+                return [self.nlp(txt) for txt in texts]
+            logger.info("Parsing %s texts in batches of %s with %s workers",
+                        len(texts), self.batch_size, self.workers)
+            return list(self.nlp.pipe(texts, batch_size=self.batch_size, n_threads=self.workers))
+
+    def _load_doc(self, data):
+        with self._nlp_lock:
+            return Doc(self.nlp.vocab).from_bytes(data)
+
     def __call__(self, document, sentences_count, user_dict):
+        """
+        `document` is either raw text, which is parsed here, or a sequence
+        of already parsed sentence spans that are used as is.
+        """
         self._ensure_dependecies_installed()
-        self.nlp_doc = self.nlp(document)
-        self.user_dict = user_dict
+        if isinstance(document, string_types):
+            sentences = list(self._parse([document])[0].sents)
+        else:
+            sentences = list(document)
+        ctx = LsaContext(sentences, user_dict)
         logger.info("Created doc")
         
-        dictionary = self._create_dictionary()
-        # empty document
-        if not dictionary:
-            return ()
-        matrix = self._create_matrix(dictionary)
-        matrix = self._compute_term_frequency(matrix)
-        u, sigma, v = singular_value_decomposition(matrix, full_matrices=False)
-
-        ranks = iter(self._compute_ranks(sigma, v))
-        sents = [s.text for s in self.nlp_doc.sents]
-        logger.info("Sentences generated by spacy are %s, count %s", sents, len(sents))
+        with metrics.timed('matrix'):
+            dictionary = self._create_dictionary(ctx)
+            # empty document
+            if not dictionary:
+                return ()
+            matrix = self._create_sparse_matrix(ctx, dictionary)
+        return self._best_sentences(ctx.sentences, matrix, sentences_count)
+
+    def summarize_windows(self, sentences, user_dict, windows):
+        """
+        Summaries of several windows over the same parsed `sentences`. Each
+        window is a (column indices, sentences_count) pair; the term matrix
+        is built once and every window ranks its subset of the columns.
+        """
+        self._ensure_dependecies_installed()
+        ctx = LsaContext(list(sentences), user_dict)
+        with metrics.timed('matrix'):
+            dictionary = self._create_dictionary(ctx)
+            if not dictionary:
+                return [() for _ in windows]
+            matrix = self._create_sparse_matrix(ctx, dictionary).tocsc()
+        summaries = []
+        for (cols, sentences_count) in windows:
+            if not len(cols):
+                summaries.append(())
+                continue
+            sub = matrix[:, cols].tocsr()
+            # Words absent from the window would only add zero rows
+            sub = sub[sub.getnnz(axis=1) > 0]
+            summaries.append(self._best_sentences([ctx.sentences[c] for c in cols], sub, sentences_count)
+                             if sub.shape[0] else ())
+        return summaries
+
+    def _best_sentences(self, sentences, matrix, sentences_count):
+        with metrics.timed('svd'):
+            sigma, v = self._singular_values(matrix)
+        with metrics.timed('ranking'):
+            ranks = iter(self._compute_ranks(sigma, v))
+        spans = dict((s.text, s) for s in sentences)
+        sents = [s.text for s in sentences]
+        logger.info("Sentences generated by spacy are %s, count %s", capped(sents), len(sents), extra=VERBOSE)
         new_sents = self._get_best_sentences(sents, sentences_count*2,
             lambda s: next(ranks))
-        filt_sents = [sent for sent in new_sents if self.better_question(sent)]
+        filt_sents = [sent for sent in new_sents if self.better_question(spans[sent])]
         additional_sents = set(new_sents) - set(filt_sents)
         to_add = sentences_count - len(filt_sents)
         final_sents = filt_sents
@@ -73,26 +179,32 @@ class LsaSummarizer(BaseSummarizer):
         return final_sents
 
 
-    def better_question(self, txt):
-        if len(txt.split()) > 5:
-            parse = self.nlp(txt)
-            for sent in parse.sents:
-                if len(sent) > 5:
-                    p2 = self.nlp(sent.text)
-                    for (i, wd) in enumerate(p2):
-                        if wd.lemma_ in (u'can', u'should', u'will', u'could', u'why', u'what', u'how', u'is'):
-                            return u'ROOT' in [x.dep_ for x in p2[i+1:]] and u'?' in  [x.orth_ for x in p2[i+1:]]              
+    def better_question(self, sent):
+        """Is the sentence a question; `sent` is a parsed span or raw text"""
+        spans = self._parse([sent])[0].sents if isinstance(sent, string_types) else [sent]
+        for span in spans:
+            if len(span) > 5 and len(span.text.split()) > 5:
+                toks = list(span)
+                for (i, wd) in enumerate(toks):
+                    if wd.lemma_ in (u'can', u'should', u'will', u'could', u'why', u'what', u'how', u'is'):
+                        return u'ROOT' in [x.dep_ for x in toks[i+1:]] and u'?' in  [x.orth_ for x in toks[i+1:]]
 
 
     def _ensure_dependecies_installed(self):
         if numpy is None:
             raise ValueError("LSA summarizer requires NumPy. Please, install it by command 'pip install numpy'.")
+        if truncated_svd is None:
+            raise ValueError("LSA summarizer requires SciPy. Please, install it by command 'pip install scipy'.")
+
+    def _user_id(self, user):
+        """Integer id of a user name in the lexeme string store"""
+        with self._nlp_lock:
+            return self.nlp.vocab.strings[user]
 
-    def _create_dictionary(self, ):
-        """Creates mapping key = word, value = row index"""
-        words = [wd.orth_ for wd in self.nlp_doc if wd.pos != PUNCT]
-        unique_words = frozenset(w.lemma_ for w in self.nlp_doc if w not in STOPWORDS and w.tag_ != "PRP" and (w.pos == VERB or w.pos == NOUN))
-        unique_users = frozenset(self.user_dict.values())
+    def _create_dictionary(self, ctx):
+        """Creates mapping key = lexeme id, value = row index"""
+        unique_words = frozenset(w.lemma for sent in ctx.sentences for w in sent if w not in STOPWORDS and w.tag_ != "PRP" and (w.pos == VERB or w.pos == NOUN))
+        unique_users = frozenset(self._user_id(u) for u in ctx.user_dict.values())
         logger.info("Have %s unique words" % len(unique_words))
         logger.info("Have %s unique users" % len(unique_users))
         return dict((w, i) for i, w in enumerate(unique_words|unique_users))
@@ -101,12 +213,12 @@ class LsaSummarizer(BaseSummarizer):
         sents = nlp(txt).sents
         return [x for x in [retrieve_main_bow(sent) for sent in sents] if x]
 
-    def _create_matrix(self, dictionary):
+    def _create_matrix(self, ctx, dictionary):
         """
         Creates matrix of shape |unique words|×|sentences| where cells
         contains number of occurences of words (rows) in senteces (cols).
         """
-        sentences = list(self.nlp_doc.sents)
+        sentences = ctx.sentences
         words_count = len(dictionary)
         sentences_count = len(sentences)
         logger.info ("Have %s sentences " % sentences_count)
@@ -119,44 +231,143 @@ class LsaSummarizer(BaseSummarizer):
         # create matrix |unique words|×|sentences| filled with zeroes
         matrix = numpy.zeros((words_count, sentences_count))
         for col, sentence in enumerate(sentences):
-            for word in [wd.lemma_ for wd in sentence if wd.lemma_ in dictionary]:
+            for word in [wd.lemma for wd in sentence if wd.lemma in dictionary]:
                 matrix[dictionary[word], col] += 1
-            if sentence.text in self.user_dict and len(self.user_dict[sentence.text]) > 1:
-                logger.info("Matching sentence %s with user %s", sentence.text, self.user_dict[sentence.text])
-                matrix[dictionary[self.user_dict[sentence.text]], col] += 1
+            if sentence.text in ctx.user_dict and len(ctx.user_dict[sentence.text]) > 1:
+                logger.info("Matching sentence %s with user %s", sentence.text, ctx.user_dict[sentence.text])
+                matrix[dictionary[self._user_id(ctx.user_dict[sentence.text])], col] += 1
         return matrix
 
+    def _create_sparse_matrix(self, ctx, dictionary):
+        """
+        Sparse (CSR) version of `_create_matrix` built in a single pass
+        over the sentences. Repeated (row, col) entries are summed.
+        """
+        sentences = ctx.sentences
+        words_count = len(dictionary)
+        sentences_count = len(sentences)
+        logger.info ("Have %s sentences " % sentences_count)
+        rows = []
+        cols = []
+        for col, sentence in enumerate(sentences):
+            for wd in sentence:
+                row = dictionary.get(wd.lemma)
+                if row is not None:
+                    rows.append(row)
+                    cols.append(col)
+            user = ctx.user_dict.get(sentence.text)
+            if user and len(user) > 1:
+                rows.append(dictionary[self._user_id(user)])
+                cols.append(col)
+        data = numpy.ones(len(rows), dtype=self.dtype)
+        return coo_matrix((data, (rows, cols)), shape=(words_count, sentences_count),
+                          dtype=self.dtype).tocsr()
+
+    def _term_frequency_operator(self, matrix, smooth=0.4):
+        """
+        Linear operator equal to `_compute_term_frequency` applied to the
+        sparse `matrix` without densifying it. Smoothing fills every cell of
+        a non-empty column, so the result is the scaled sparse counts plus
+        the rank one term `smooth * ones x column_mask`.
+        """
+        assert 0.0 <= smooth < 1.0
+
+        max_word_frequencies = matrix.max(axis=0).toarray().ravel()
+        non_empty = max_word_frequencies != 0
+        scale = numpy.zeros_like(max_word_frequencies)
+        scale[non_empty] = (1.0 - smooth)/max_word_frequencies[non_empty]
+        scaled = matrix.dot(diags(scale, 0)).tocsr()
+        scaled_t = scaled.T.tocsr()
+        offset = numpy.where(non_empty, smooth, 0.0).astype(self.dtype)
+
+        def matvec(x):
+            x = numpy.ravel(x)
+            return scaled.dot(x) + offset.dot(x)
+
+        def rmatvec(y):
+            y = numpy.ravel(y)
+            return scaled_t.dot(y) + offset*y.sum()
+
+        return LinearOperator(matrix.shape, matvec=matvec, rmatvec=rmatvec,
+                              dtype=self.dtype)
+
+    def _singular_values(self, matrix, smooth=0.4):
+        """
+        Returns (sigma, v) of the TF weighted `matrix`, sorted by decreasing
+        singular value. Small matrices take the dense path so rankings are
+        unchanged; larger ones only compute the top `max_dimensions` triplets.
+        """
+        dimensions = min(self.max_dimensions, min(matrix.shape) - 1)
+        if matrix.shape[1] <= self.DENSE_LIMIT or dimensions < LsaSummarizer.MIN_DIMENSIONS:
+            dense = self._compute_term_frequency(matrix.toarray(), smooth)
+            u, sigma, v = singular_value_decomposition(dense, full_matrices=False)
+            return sigma, v
+        logger.info("Computing %s singular triplets of a %s matrix", dimensions, matrix.shape)
+        u, sigma, v = truncated_svd(self._term_frequency_operator(matrix, smooth), k=dimensions)
+        order = numpy.argsort(sigma)[::-1]
+        return sigma[order], v[order]
+
     def _compute_term_frequency(self, matrix, smooth=0.4):
         """
         Computes TF metrics for each sentence (column) in the given matrix.
         You can read more about smoothing parameter at URL below:
         http://nlp.stanford.edu/IR-book/html/htmledition/maximum-tf-normalization-1.html
         """
-        assert 0.0 <= smooth < 1.0
-
-        max_word_frequencies = numpy.max(matrix, axis=0)
-        rows, cols = matrix.shape
-        for row in range(rows):
-            for col in range(cols):
-                max_word_frequency = max_word_frequencies[col]
-                if max_word_frequency != 0:
-                    frequency = matrix[row, col]/max_word_frequency
-                    matrix[row, col] = smooth + (1.0 - smooth)*frequency
-        return matrix
+        return compute_term_frequency(matrix, smooth)
 
     def _compute_ranks(self, sigma, v_matrix):
-        assert len(sigma) == v_matrix.shape[0], "Matrices should be multiplicable"
+        return compute_ranks(sigma, v_matrix)
+
+def compute_term_frequency(matrix, smooth=0.4, row_mask=None):
+    """
+    Vectorized max-TF smoothing of a |words|x|sentences| matrix, or of a
+    stack of them with shape (documents, words, sentences). `row_mask`
+    marks the real word rows of zero padded stacks so padding stays zero.
+    """
+    assert 0.0 <= smooth < 1.0
+
+    max_word_frequencies = numpy.max(matrix, axis=-2, keepdims=True)
+    non_empty = max_word_frequencies != 0
+    if row_mask is not None:
+        non_empty = non_empty & row_mask
+    frequency = numpy.divide(matrix, numpy.where(non_empty, max_word_frequencies, 1.0))
+    return numpy.where(non_empty, smooth + (1.0 - smooth)*frequency, matrix)
 
+def compute_ranks(sigma, v_matrix, dimensions=None):
+    """
+    Sentence ranks sqrt(sum_i sigma_i**2 * v_ij**2) computed with a single
+    matrix product. Works on stacked (documents, k) / (documents, k, sentences)
+    inputs, in which case `dimensions` may give the dimension count per document.
+    """
+    assert sigma.shape[-1] == v_matrix.shape[-2], "Matrices should be multiplicable"
+
+    if dimensions is None:
         dimensions = max(LsaSummarizer.MIN_DIMENSIONS,
-            int(len(sigma)*LsaSummarizer.REDUCTION_RATIO))
-        powered_sigma = tuple(s**2 if i < dimensions else 0.0
-            for i, s in enumerate(sigma))
-        ranks = []
-        # iterate over columns of matrix (rows of transposed matrix)
-        for column_vector in v_matrix.T:
-            rank = sum(s*v**2 for s, v in zip(powered_sigma, column_vector))
-            ranks.append(math.sqrt(rank))
-        return ranks
+            int(sigma.shape[-1]*LsaSummarizer.REDUCTION_RATIO))
+    in_use = numpy.arange(sigma.shape[-1]) < numpy.asarray(dimensions)[..., None]
+    powered_sigma = numpy.where(in_use, sigma**2, 0.0)
+    ranks = numpy.matmul(powered_sigma[..., None, :], v_matrix**2)[..., 0, :]
+    return numpy.sqrt(ranks)
+
+def batch_ranks(matrices, smooth=0.4):
+    """
+    Ranks the sentences of several term-sentence count matrices at once.
+    The matrices are zero padded into one stack so the TF smoothing, the
+    SVD and the ranking each run as a single vectorized call.
+    """
+    words_count = max(m.shape[0] for m in matrices)
+    sentences_count = max(m.shape[1] for m in matrices)
+    stacked = numpy.zeros((len(matrices), words_count, sentences_count))
+    row_mask = numpy.zeros((len(matrices), words_count, 1), dtype=bool)
+    for i, matrix in enumerate(matrices):
+        stacked[i, :matrix.shape[0], :matrix.shape[1]] = matrix
+        row_mask[i, :matrix.shape[0]] = True
+    stacked = compute_term_frequency(stacked, smooth, row_mask)
+    u, sigma, v = singular_value_decomposition(stacked, full_matrices=False)
+    dimensions = [max(LsaSummarizer.MIN_DIMENSIONS,
+                      int(min(m.shape)*LsaSummarizer.REDUCTION_RATIO)) for m in matrices]
+    ranks = compute_ranks(sigma, v, dimensions)
+    return [ranks[i, :matrix.shape[1]] for i, matrix in enumerate(matrices)]
 
 def retrieve_main_bow(tokens):
     bow = set()
@@ -1,27 +1,72 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 import requests
 import json
 import os
+import time
 from config import *
-from ts_config import SUMMS
+from ts_config import (SUMMS, DEFERRED, DEFERRED_WORKERS, DEFERRED_QUEUE,
+                       DEFERRED_TIMEOUT, DEFERRED_RUNNERS, NLP_SOCKETS)
 from slack_summary import SlackRouter
+from job_pool import JobPool
 app = Flask(__name__)
-from utils import maybe_get
-global lsa_summ
-lsa_summ = None
-if "spacy" in SUMMS:
-        import lsa
-        import spacy.en
-        import spacy
-        lsa_summ = lsa.LsaSummarizer()
+from utils import maybe_get, process_report
+from engines import registry as engines
+import metrics
+started_at = time.time()
+
+def get_lsa_summ():
+        """The shared LSA summarizer, imported and loaded on first use"""
+        if "spacy" in SUMMS and not NLP_SOCKETS:
+                return engines.get('lsa')
+        return None
+
+
+global ready
+ready = False
+WARM_UP_TEXT = u"Warm up the parser so that its models are loaded before the workers fork."
+
+def warm_up():
+        """Load and exercise the NLP model so forked workers share its pages"""
+        global ready
+        if not NLP_SOCKETS:
+                engines.warm_up([name for name in engines.names()
+                                 if name in SUMMS or (name == 'lsa' and "spacy" in SUMMS)])
+        if get_lsa_summ():
+                list(get_lsa_summ().nlp(WARM_UP_TEXT).sents)
+        ready = True
+        app.logger.info(u'Warm up done %s', process_report(started_at))
+
+
+@app.route("/ready", methods=['GET'])
+def readyReq():
+        """Healthy only once the model has been warmed up"""
+        report = process_report(started_at)
+        report['ready'] = ready
+        report['engines'] = engines.report()
+        return jsonify(report), (200 if ready else 503)
+
+
+@app.route("/metrics", methods=['GET'])
+def metricsReq():
+        """Stage timings and request counts of this process for Prometheus"""
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+global job_pool
+job_pool = None
+DEFERRED_ACK = u"Working on your summary, it will be posted here shortly."
+DEFERRED_BUSY = u"Too many summaries are in progress, please try again in a minute."
+
+def get_job_pool():
+        """The worker pool for deferred summaries, started on first use"""
+        global job_pool
+        if not job_pool:
+                job_pool = JobPool(DEFERRED_WORKERS, DEFERRED_QUEUE, DEFERRED_TIMEOUT, DEFERRED_RUNNERS)
+        return job_pool
 
 
 @app.route("/slack", methods=['POST'])
 def slackReq():
-        global lsa_summ
-        if "spacy" in SUMMS:
-                if not lsa_summ:
-                        lsa_summ = lsa.LsaSummarizer()
 	req_data = request.form
         req = {
 	        'channel_id' : req_data.getlist('channel_id'),
@@ -29,19 +74,23 @@ def slackReq():
                 'user_id' : maybe_get(req_data, 'user_id', default=''),
                 'user_name' : maybe_get(req_data, 'user_name', default=''),
                 'params' : maybe_get(req_data, 'text', default=''),
-                'summ' : lsa_summ
+                'summ' : get_lsa_summ()
                 }
+        req['engine'] = "spacy" if "spacy" in SUMMS else "gensim"
         if "gensim" in SUMMS and "gensim" in req['params'].split():
                 req['summ'] = None
+                req['engine'] = "gensim"
+        response_url = maybe_get(req_data, 'response_url')
+        if DEFERRED and response_url:
+                if get_job_pool().submit(lambda progress: SlackRouter().get_summary(progress=progress, **req),
+                                         response_url):
+                        return DEFERRED_ACK
+                return DEFERRED_BUSY
 	return (SlackRouter().get_summary(**req))
 
 
 @app.route("/slacktest", methods=['POST'])
 def slackTestReq():
-        global lsa_summ
-        if "spacy" in SUMMS:
-                if not lsa_summ:
-                        lsa_summ = lsa.LsaSummarizer()
 	req_data = request.form
         req = {
 	        'channel_id' : req_data.getlist('channel_id'),
@@ -49,15 +98,18 @@ def slackTestReq():
                 'user_id' : maybe_get(req_data, 'user_id', default=''),
                 'user_name' : maybe_get(req_data, 'user_name', default=''),
                 'params' : maybe_get(req_data, 'text', default=''),
-                'summ' : lsa_summ,
+                'summ' : get_lsa_summ(),
                 'test' : True
                 }
+        req['engine'] = "spacy" if "spacy" in SUMMS else "gensim"
         if "gensim" in SUMMS and "gensim" in req['params'].split():
                 req['summ'] = None
+                req['engine'] = "gensim"
 	return (SlackRouter(test=True).get_summary(**req))
 
 def main():
         port = int(os.environ.get('PORT', 5000))
+        warm_up()
         app.run(host='0.0.0.0', port=port, debug=False)
         
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite backed local copy of channel history. For every channel the store
+remembers the span of time it holds, so a summary only has to ask Slack
+for messages newer than what is already on disk.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from contextlib import closing
+import json
+import sqlite3
+import threading
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS messages (
+         channel TEXT NOT NULL,
+         ts TEXT NOT NULL,
+         ts_num REAL NOT NULL,
+         body TEXT NOT NULL,
+         PRIMARY KEY (channel, ts))""",
+    """CREATE INDEX IF NOT EXISTS messages_by_time ON messages (channel, ts_num)""",
+    """CREATE TABLE IF NOT EXISTS channels (
+         channel TEXT PRIMARY KEY,
+         oldest REAL NOT NULL,
+         newest REAL NOT NULL)""",
+]
+
+
+class MessageStore(object):
+    """Channel history keyed by (channel, ts)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            for stmt in SCHEMA:
+                conn.execute(stmt)
+            conn.commit()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def coverage(self, channel):
+        """Return (oldest, newest) float timestamps held for the channel or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT oldest, newest FROM channels WHERE channel = ?",
+                               (channel,)).fetchone()
+        return tuple(row) if row else None
+
+    def replace(self, channel, oldest, msgs):
+        """
+        Make `msgs` the stored history of the channel from `oldest` on.
+        Stored messages in that range that are missing from `msgs` were
+        deleted upstream and are dropped; the rest are overwritten so edits
+        are picked up. When `oldest` is past the stored span the time in
+        between was never fetched, so the stored history is dropped.
+        """
+        newest = max([float(msg['ts']) for msg in msgs] + [oldest])
+        with self._lock:
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT oldest, newest FROM channels WHERE channel = ?",
+                                   (channel,)).fetchone()
+                if row and oldest > row[1]:
+                    conn.execute("DELETE FROM messages WHERE channel = ?", (channel,))
+                    row = None
+                conn.execute("DELETE FROM messages WHERE channel = ? AND ts_num >= ?",
+                             (channel, oldest))
+                conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)",
+                                 [(channel, msg['ts'], float(msg['ts']), json.dumps(msg))
+                                  for msg in msgs])
+                if row:
+                    oldest = min(oldest, row[0])
+                    newest = max(newest, row[1])
+                conn.execute("INSERT OR REPLACE INTO channels VALUES (?, ?, ?)",
+                             (channel, oldest, newest))
+                conn.commit()
+
+    def messages(self, channel, oldest, latest=None):
+        """Stored messages with oldest <= ts (< latest), newest first like Slack"""
+        query = "SELECT body FROM messages WHERE channel = ? AND ts_num >= ?"
+        args = [channel, oldest]
+        if latest is not None:
+            query += " AND ts_num < ?"
+            args.append(latest)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query + " ORDER BY ts_num DESC", args).fetchall()
+        return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+In process counters and histograms for the summary pipeline, rendered in
+the Prometheus text format by the /metrics route.
+
+Stages are timed with
+
+    with metrics.timed('svd'):
+        ...
+
+which feeds the `summary_stage_seconds` histogram and logs the duration
+tagged with the id of the request being served on this thread (set by
+`metrics.request`). Request ids stay out of the metric labels to keep
+their cardinality bounded. Each process keeps its own metrics. Helper
+threads working for a request are tagged with `metrics.tagged`, which
+also profiles them when the request is profiled.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from ts_config import PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 1000000)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return u''
+    return u'{' + u','.join(u'{}="{}"'.format(k, v) for (k, v) in pairs) + u'}'
+
+
+class Counter(object):
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [u'# HELP {} {}'.format(self.name, self.doc),
+                 u'# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for (values, total) in sorted(self._values.items()):
+                lines.append(u'{}{} {}'.format(self.name, _labels(self.labels, values), total))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, doc, buckets, labels=()):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # bucket counts, sum, count
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [u'# HELP {} {}'.format(self.name, self.doc),
+                 u'# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for (values, (counts, total, count)) in sorted(self._series.items()):
+                for (bound, bucket) in zip(self.buckets, counts):
+                    lines.append(u'{}_bucket{} {}'.format(self.name, _labels(self.labels, values, [('le', bound)]), bucket))
+                lines.append(u'{}_bucket{} {}'.format(self.name, _labels(self.labels, values, [('le', '+Inf')]), count))
+                lines.append(u'{}_sum{} {}'.format(self.name, _labels(self.labels, values), round(total, 6)))
+                lines.append(u'{}_count{} {}'.format(self.name, _labels(self.labels, values), count))
+        return lines
+
+
+stage_seconds = Histogram('summary_stage_seconds', 'Seconds spent in each summary stage',
+                          TIME_BUCKETS, labels=('stage',))
+request_seconds = Histogram('summary_request_seconds', 'Seconds to answer a summary request',
+                            TIME_BUCKETS, labels=('engine',))
+messages = Histogram('summary_messages', 'Messages fetched per summary request', SIZE_BUCKETS)
+pages = Histogram('summary_history_pages', 'channels.history pages fetched per request', SIZE_BUCKETS)
+requests_total = Counter('summary_requests_total', 'Summary requests served', labels=('engine',))
+slow_profiles = Counter('summary_slow_profiles_total', 'Slow requests whose profile was saved')
+plans = Counter('summary_plans_total', 'Summary plans run and whether they beat the deadline',
+                labels=('plan', 'outcome'))
+ALL = [stage_seconds, request_seconds, messages, pages, requests_total, slow_profiles, plans]
+
+_local = threading.local()
+
+
+def current_request():
+    return getattr(_local, 'request_id', None)
+
+
+def current_profile():
+    """The `RequestProfile` of the request on this thread, None when it is not profiled"""
+    return getattr(_local, 'profile', None)
+
+
+class RequestProfile(object):
+    """
+    The cProfile profiles of the threads of one request, a profiler only
+    sees the thread enabling it. They are saved together when the request
+    ends slow; a helper thread still running by then saves its own later.
+    """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.profilers = []
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def add(self, profiler):
+        with self._lock:
+            if self.elapsed is None:
+                self.profilers.append(profiler)
+                return
+        if self.elapsed > PROFILE_SLOW_SECONDS:
+            save_profile([profiler], u'{}.late'.format(self.request_id), self.elapsed)
+
+    def finish(self, elapsed):
+        with self._lock:
+            self.elapsed = elapsed
+        if elapsed > PROFILE_SLOW_SECONDS:
+            save_profile(self.profilers, self.request_id, elapsed)
+
+
+@contextmanager
+def timed(stage):
+    """Time a stage of the request running on this thread"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        stage_seconds.observe(elapsed, stage)
+        logger.debug(u'Summary request %s stage %s took %.4fs', current_request(), stage, elapsed)
+
+
+@contextmanager
+def tagged(request_id, profile=None):
+    """Tag the stages of this (helper) thread with `request_id`, profiled into `profile`"""
+    _local.request_id = request_id
+    _local.profile = profile
+    profiler = None
+    if profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profile.add(profiler)
+        _local.request_id = None
+        _local.profile = None
+
+
+@contextmanager
+def request(request_id, engine):
+    """
+    Tag this thread's stages with `request_id` and time the whole request.
+    A PROFILE_SAMPLE_RATE fraction of requests runs under cProfile and the
+    profile is kept in PROFILE_DIR when the request took longer than
+    PROFILE_SLOW_SECONDS, together with those of its `tagged` helper threads.
+    """
+    _local.request_id = request_id
+    profile = profiler = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        profile = RequestProfile(request_id)
+        profiler = cProfile.Profile()
+        profiler.enable()
+    _local.profile = profile
+    start = time.time()
+    try:
+        yield
+    finally:
+        elapsed = time.time() - start
+        if profiler:
+            profiler.disable()
+            profile.add(profiler)
+            profile.finish(elapsed)
+        request_seconds.observe(elapsed, engine)
+        requests_total.inc(1, engine)
+        _local.request_id = None
+        _local.profile = None
+
+
+def save_profile(profilers, request_id, elapsed):
+    """The merged `profilers` saved as the profile of the request"""
+    if not os.path.isdir(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    fname = os.path.join(PROFILE_DIR, u'{}.prof'.format(request_id))
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    stats.dump_stats(fname)
+    slow_profiles.inc()
+    logger.info(u'Summary request %s took %.2fs, profile saved to %s', request_id, elapsed, fname)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in ALL:
+        lines.extend(metric.render())
+    return u'\n'.join(lines) + u'\n'
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Collapses near duplicate messages (repeated alerts, bot spam, copy pasted
+text) before ranking. Messages are MinHashed over their word shingles,
+with numbers masked so alerts differing only in hosts or times match, and
+LSH bands bucket the signatures; bucket mates whose signatures agree on at
+least `threshold` of the rows form a cluster. Everything is linear in the
+number of shingles. Exact copies are folded first by `exact`, and their
+count carries over into the clusters.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from collections import defaultdict, OrderedDict
+from functools import partial
+from itertools import count
+from operator import attrgetter
+import re
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ts_config import NEAR_DUP_THRESHOLD, NEAR_DUP_BANDS, NEAR_DUP_ROWS
+
+# Universal hashing (a * x + b) mod PRIME of the 32 bit shingle hashes
+PRIME = 4294967311
+SEED = 1441925382
+# Shingles hashed per block, bounding the (permutations x shingles) array
+BLOCK = 1 << 16
+
+words = re.compile(r'\w+', re.UNICODE)
+numbers = re.compile(r'\d+', re.UNICODE)
+
+
+def tokens(texts):
+    """
+    32 bit hashes of the words of all texts (numbers masked) in one array,
+    and the index of the text of each. Every distinct word is hashed once.
+    """
+    found = []
+    counts = []
+    for text in texts:
+        text_words = words.findall(numbers.sub(u'0', text.lower()))
+        found.extend(text_words)
+        counts.append(len(text_words))
+    # Numbered in order of appearance
+    vocabulary = defaultdict(partial(next, count()))
+    ids = [vocabulary[word] for word in found]
+    hashed = numpy.zeros(len(vocabulary), dtype=numpy.uint64)
+    for (word, i) in vocabulary.items():
+        hashed[i] = zlib.crc32(word.encode('utf-8')) & 0xffffffff
+    owners = numpy.repeat(numpy.arange(len(texts)), counts)
+    return hashed[numpy.array(ids, dtype=numpy.int64)], owners
+
+
+def shingles(texts):
+    """
+    Hashes of the word bigrams of every text (its word for one word texts)
+    sorted by text, and the index of the text of each.
+    """
+    flat, owners = tokens(texts)
+    pairs = numpy.flatnonzero(owners[1:] == owners[:-1])
+    bigrams = ((flat[pairs] * numpy.uint64(1000003)) ^ flat[pairs + 1]) & numpy.uint64(0xffffffff)
+    counts = numpy.bincount(owners, minlength=len(texts))
+    single = numpy.flatnonzero(counts[owners] == 1)
+    hashes = numpy.concatenate((bigrams, flat[single]))
+    of = numpy.concatenate((owners[pairs], owners[single]))
+    order = numpy.argsort(of, kind='mergesort')
+    return hashes[order], of[order]
+
+
+def signatures(texts, permutations):
+    """
+    (permutations x texts) MinHash signatures, and which texts have any
+    shingle; the columns of those that do not are meaningless.
+    """
+    rng = numpy.random.RandomState(SEED)
+    a = rng.randint(1, 1 << 31, size=permutations).astype(numpy.uint64)[:, None]
+    b = rng.randint(0, 1 << 31, size=permutations).astype(numpy.uint64)[:, None]
+    hashes, of = shingles(texts)
+    found = numpy.bincount(of, minlength=len(texts)) > 0
+    sigs = numpy.zeros((permutations, len(texts)), dtype=numpy.uint64)
+    # Blocks of about BLOCK shingles, cut between texts
+    cuts = numpy.flatnonzero(numpy.diff(of)) + 1
+    firsts = numpy.concatenate(([0], cuts)) if len(of) else numpy.zeros(0, dtype=numpy.int64)
+    lo = 0
+    while lo < len(firsts):
+        hi = max(lo + 1, numpy.searchsorted(firsts, firsts[lo] + BLOCK))
+        end = firsts[hi] if hi < len(firsts) else len(of)
+        block = (a * hashes[firsts[lo]:end] + b) % numpy.uint64(PRIME)
+        sigs[:, of[firsts[lo:hi]]] = numpy.minimum.reduceat(block, firsts[lo:hi] - firsts[lo], axis=1)
+        lo = hi
+    return sigs, found
+
+
+def clusters(texts, threshold=NEAR_DUP_THRESHOLD, bands=NEAR_DUP_BANDS, rows=NEAR_DUP_ROWS):
+    """Lists of the indices of near duplicate texts, every text in one of them"""
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if bands and len(texts) > 1:
+        sigs, found = signatures(texts, bands * rows)
+        mixers = numpy.random.RandomState(SEED + 1).randint(1, 1 << 31, size=rows).astype(numpy.uint64)
+        candidates = numpy.flatnonzero(found)
+        for band in range(bands):
+            # One key per text and band, the texts of a bucket sort together
+            keys = (sigs[band * rows:(band + 1) * rows, candidates] * mixers[:, None]).sum(axis=0)
+            by_key = numpy.argsort(keys, kind='mergesort')
+            order = candidates[by_key]
+            bounds = numpy.flatnonzero(numpy.diff(keys[by_key])) + 1
+            starts = numpy.concatenate(([0], bounds))
+            ends = numpy.concatenate((bounds, [len(order)]))
+            # Most buckets hold a single text, only the others are visited
+            for (lo, hi) in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+                first = order[lo]
+                for other in order[lo + 1:hi]:
+                    if find(other) != find(first) and \
+                            (sigs[:, other] == sigs[:, first]).mean() >= threshold:
+                        parent[find(other)] = find(first)
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values())
+
+
+def exact(records, key=attrgetter('text')):
+    """
+    One record per group of records with the same `key` (default their
+    text): the newest, copied with `similar` set to the number of others.
+    Returned in the order of their first copies.
+    """
+    groups = OrderedDict()
+    for rec in records:
+        groups.setdefault(key(rec), []).append(rec)
+    reps = []
+    for group in groups.values():
+        newest = max(group, key=attrgetter('ts'))
+        reps.append(newest.folded(len(group) - 1) if len(group) > 1 else newest)
+    return reps
+
+
+def collapse(records, threshold=NEAR_DUP_THRESHOLD, bands=NEAR_DUP_BANDS, rows=NEAR_DUP_ROWS):
+    """
+    One record per cluster of near duplicate records: the newest, copied
+    with `similar` set to the number of others it stands for, including
+    those the clustered records already stood for. Returned in the order
+    of the input.
+    """
+    records = list(records)
+    if numpy is None or not bands or len(records) < 2:
+        return records
+    reps = []
+    for group in clusters([rec.text for rec in records], threshold, bands, rows):
+        newest = max(group, key=lambda i: records[i].ts)
+        similar = sum(records[i].similar for i in group) + len(group) - 1
+        reps.append((newest, records[newest].folded(similar) if len(group) > 1 else records[newest]))
+    return [rec for (i, rec) in sorted(reps, key=lambda rep: rep[0])]
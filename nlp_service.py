@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Standalone process owning the NLP engines. Web workers send it batches of
+summarize jobs over a Unix socket so they do not have to load spaCy or
+gensim themselves. Start one or more with
+
+    python ./nlp_service.py /tmp/slack-summary-nlp-0.sock
+
+and list the sockets in `NLP_SOCKETS` in ts_config.py.
+
+Frames on the socket are a 4 byte big endian length followed by UTF-8
+JSON. A request is {"jobs": [job, ...]} where a job holds the `engine`
+("spacy" or "gensim"), `msgs`, `channel` and `range_spec` or the
+`windows` of a multi window summary; the reply is
+{"summaries": [...]} in job order, or {"error": message}.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import itertools
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+from ts_config import SUMMS
+from engines import registry
+
+logger = logging.getLogger(__name__)
+HEADER = struct.Struct(str('>I'))
+
+
+def write_frame(fh, obj):
+    data = json.dumps(obj).encode('utf-8')
+    fh.write(HEADER.pack(len(data)) + data)
+    fh.flush()
+
+
+def read_frame(fh):
+    """Next frame from the stream, None at end of stream"""
+    header = fh.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    return json.loads(fh.read(length).decode('utf-8'))
+
+
+class NlpEngines(object):
+    """The summarization engines, loaded once for the life of the process"""
+
+    def __init__(self, summs=SUMMS):
+        self.lsa_summ = None
+        if "spacy" in summs:
+            self.lsa_summ = registry.get('lsa')
+            registry.get('spacy')
+        if "gensim" in summs:
+            registry.get('gensim')
+
+    def summarize(self, engine, msgs, channel=None, range_spec=None, windows=None):
+        if engine == "spacy" and self.lsa_summ:
+            summ_impl = registry.get('spacy')()
+            summ_impl.set_summarizer(self.lsa_summ)
+        else:
+            summ_impl = registry.get('gensim')()
+        summ_impl.set_channel(channel)
+        if windows:
+            return summ_impl.summarize_windows(msgs, windows)
+        return summ_impl.summarize(msgs, range_spec=range_spec)
+
+
+class NlpHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            request = read_frame(self.rfile)
+            if request is None:
+                return
+            try:
+                reply = {'summaries': [self.server.engines.summarize(**job)
+                                       for job in request['jobs']]}
+            except Exception as err:
+                logger.exception(u'Summarize jobs failed')
+                reply = {'error': u'{}'.format(err)}
+            write_frame(self.wfile, reply)
+
+
+class NlpServer(socketserver.UnixStreamServer):
+    """Serves jobs one connection at a time; run several for parallelism"""
+
+    def __init__(self, path, engines):
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, NlpHandler)
+        self.engines = engines
+
+
+class NlpServiceError(Exception):
+    pass
+
+
+class NlpClient(object):
+    """Sends summarize jobs to the NLP service sockets in turn"""
+
+    def __init__(self, paths, timeout=None):
+        self.paths = list(paths)
+        self.timeout = timeout
+        self._next = itertools.cycle(range(len(self.paths)))
+        self._lock = threading.Lock()
+
+    def summarize(self, jobs):
+        """Summaries for a batch of jobs, trying each socket until one answers"""
+        with self._lock:
+            start = next(self._next)
+        err = None
+        for i in range(len(self.paths)):
+            path = self.paths[(start + i) % len(self.paths)]
+            try:
+                reply = self._request(path, {'jobs': jobs})
+            except (socket.error, IOError, ValueError) as exc:
+                logger.warn(u'NLP service at %s failed: %s', path, exc)
+                err = exc
+                continue
+            if 'error' in reply:
+                raise NlpServiceError(reply['error'])
+            return reply['summaries']
+        raise NlpServiceError(u'No NLP service available: {}'.format(err))
+
+    def summarize_one(self, engine, msgs, channel=None, range_spec=None, windows=None):
+        job = {'engine': engine, 'msgs': msgs, 'channel': channel, 'range_spec': range_spec}
+        if windows:
+            job['windows'] = windows
+        return self.summarize([job])[0]
+
+    def _request(self, path, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(path)
+            fh = sock.makefile('rwb')
+            write_frame(fh, request)
+            reply = read_frame(fh)
+            fh.close()
+        finally:
+            sock.close()
+        if reply is None:
+            raise IOError(u'Connection closed by {}'.format(path))
+        return reply
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else '/tmp/slack-summary-nlp-0.sock'
+    server = NlpServer(path, NlpEngines())
+    logger.info(u'NLP service listening on %s', path)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Two tier cache for parsed messages. Entries are keyed by the message
+identity (channel, ts, text hash) so an edited message misses. The first
+tier is a bounded in-memory LRU, the second a directory of serialized
+parses evicted oldest first once it grows past a byte budget.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def message_key(channel, ts, txt):
+    """Cache key for the parse of `txt` posted at `ts` in `channel`"""
+    digest = hashlib.sha1(txt.encode('utf-8')).hexdigest()
+    return u'{}:{}:{}'.format(channel or u'', ts, digest)
+
+
+class LruCache(object):
+    """Thread safe in-memory cache holding at most `size` entries"""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache(object):
+    """
+    Directory of byte strings, one file per key, limited to `max_bytes`.
+    Files are written atomically and the least recently used are removed
+    once the budget is exceeded.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        entries = []
+        for name in os.listdir(path):
+            st = os.stat(os.path.join(path, name))
+            entries.append((st.st_mtime, name, st.st_size))
+        self._files = OrderedDict((name, size) for (mtime, name, size) in sorted(entries))
+        self._bytes = sum(self._files.values())
+
+    def _file(self, key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key, default=None):
+        name = self._file(key)
+        try:
+            with open(os.path.join(self.path, name), 'rb') as fh:
+                data = fh.read()
+        except (IOError, OSError):
+            return default
+        with self._lock:
+            if name in self._files:
+                self._files[name] = self._files.pop(name)
+        try:
+            os.utime(os.path.join(self.path, name), None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        name = self._file(key)
+        fname = os.path.join(self.path, name)
+        tmp = u'{}.{}.{}.tmp'.format(fname, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.rename(tmp, fname)
+        with self._lock:
+            self._bytes += len(data) - self._files.pop(name, 0)
+            self._files[name] = len(data)
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                old, size = self._files.popitem(last=False)
+                self._bytes -= size
+                try:
+                    os.remove(os.path.join(self.path, old))
+                except OSError:
+                    pass
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._files)
+
+
+class ParseCache(object):
+    """
+    Memory then disk lookup of serialized parses. `dumps` turns a parse
+    into bytes for the disk tier and `loads` rebuilds it on a disk hit.
+    """
+
+    def __init__(self, size, path=None, max_bytes=0, dumps=None, loads=None):
+        self.memory = LruCache(size)
+        self.disk = DiskCache(path, max_bytes) if path else None
+        self.dumps = dumps
+        self.loads = loads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+        if self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                try:
+                    value = self.loads(data) if self.loads else data
+                except Exception:
+                    logger.exception("Unable to load cached parse %s", key)
+                    value = None
+                if value is not None:
+                    self._count('disk_hits')
+                    self.memory.put(key, value)
+                    return value
+        self._count('misses')
+        return None
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, self.dumps(value) if self.dumps else value)
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'memory_entries': len(self.memory),
+                'disk_entries': len(self.disk) if self.disk is not None else 0,
+                'disk_bytes': self.disk.bytes if self.disk is not None else 0}
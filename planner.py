@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Latency budgeted choice of how a request is summarized. Each plan's cost
+is estimated from the number of messages and their text volume, the best
+plan expected to finish within the request's budget is run, and if it is
+still running at the deadline the best result completed by then (the
+heuristic summary every engine reports before its NLP stage) is returned.
+The late run cannot be stopped; it finishes in the background and its
+result is dropped. At most PLAN_RUNNERS runs are alive at once, late ones
+included; while all are busy requests are summarized by simple_sum.
+
+Plans, best first: full LSA, LSA over the K most informative candidates
+with K as large as the budget allows, TextRank and the heuristic
+simple_sum, which is always possible.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from collections import namedtuple
+import logging
+import threading
+import time
+from utils import get_msg_text
+from ts_config import PLAN_COSTS, PLAN_MIN_CANDIDATES, PLAN_RUNNERS, CANDIDATE_LIMIT
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# `engine` is the engine registry name, `limit` its candidate limit and
+# `estimate` the expected seconds
+Plan = namedtuple('Plan', ('name', 'engine', 'limit', 'estimate'))
+
+PREFERENCE = ('lsa', 'lsa_limited', 'textrank', 'simple')
+ENGINES = {'lsa': 'spacy', 'lsa_limited': 'spacy', 'textrank': 'gensim', 'simple': 'simple'}
+# A run aborted at the deadline took longer than that, how much is unknown
+MISS_FACTOR = 1.5
+
+runners = threading.BoundedSemaphore(PLAN_RUNNERS)
+
+
+class Busy(Exception):
+    """Every runner is taken by earlier runs, some possibly past their deadline"""
+
+
+def unlimited(names):
+    """The plan of `names` picked when time is no object"""
+    return min(names, key=PREFERENCE.index)
+
+
+def volume(msgs):
+    """Number of messages and thousands of characters of their text"""
+    return len(msgs), sum(len(get_msg_text(msg) or u'') for msg in msgs) / 1000.0
+
+
+class Planner(object):
+    """
+    Picks plans by their PLAN_COSTS estimates. Every plan's estimates are
+    scaled by how long its runs actually took, so the model adapts to the
+    machine it runs on and plans that keep missing the deadline give way
+    to cheaper ones.
+    """
+
+    def __init__(self, costs=PLAN_COSTS, min_candidates=PLAN_MIN_CANDIDATES,
+                 max_candidates=CANDIDATE_LIMIT):
+        self.costs = costs
+        self.min_candidates = min_candidates
+        self.max_candidates = max_candidates
+        self.scale = dict((name, 1.0) for name in costs)
+        self._lock = threading.Lock()
+
+    def estimate(self, name, messages, kchars, limit=None):
+        fixed, per_message, per_kchar = self.costs[name]
+        parsed = kchars if not limit or limit >= messages else kchars * limit / messages
+        return self.scale[name] * (fixed + per_message * messages + per_kchar * parsed)
+
+    def candidates(self, messages, kchars, budget):
+        """The largest candidate limit whose LSA fits the budget, None below the minimum"""
+        fixed, per_message, per_kchar = self.costs['lsa_limited']
+        spare = budget / self.scale['lsa_limited'] - fixed - per_message * messages
+        per_candidate = per_kchar * kchars / messages if messages else 0
+        limit = int(spare / per_candidate) if per_candidate > 0 else messages
+        limit = min(limit, messages, self.max_candidates or messages)
+        return limit if limit >= self.min_candidates else None
+
+    def plan(self, names, messages, kchars, budget):
+        """The best plan of `names` expected to take at most `budget` seconds, else simple"""
+        for name in PREFERENCE:
+            if name not in names or name not in self.costs:
+                continue
+            limit = None
+            if name == 'lsa_limited':
+                limit = self.candidates(messages, kchars, budget)
+                if limit is None:
+                    continue
+            estimate = self.estimate(name, messages, kchars, limit)
+            if estimate <= budget:
+                return Plan(name, ENGINES[name], limit, estimate)
+        return Plan('simple', ENGINES['simple'], None, self.estimate('simple', messages, kchars))
+
+    def observe(self, plan, seconds, complete=True):
+        """
+        Moves the plan's scale a fifth of the way towards the measured ratio.
+        Runs that did not complete took at least `seconds` and are counted
+        as MISS_FACTOR times that.
+        """
+        if not complete:
+            seconds *= MISS_FACTOR
+        with self._lock:
+            scale = self.scale[plan.name]
+            if plan.estimate > 0:
+                measured = seconds * scale / plan.estimate
+                self.scale[plan.name] = min(max(0.8 * scale + 0.2 * measured, 0.1), 10.0)
+
+
+def run(work, deadline, fallback, progress=None, slots=None):
+    """
+    Runs `work(report)` on a helper thread until `deadline` (epoch
+    seconds). Returns its result and True, or when the deadline passes
+    first the last text it handed to `report` (else `fallback()`) and False.
+    Reports are passed on to `progress` until then. The thread holds one
+    of the `slots` (default `runners`) until `work` returns, raises `Busy`
+    when none is free.
+    """
+    slots = runners if slots is None else slots
+    if not slots.acquire(False):
+        raise Busy()
+    state = {}
+    lock = threading.Lock()
+    request_id = metrics.current_request()
+    profile = metrics.current_profile()
+
+    def report(partial):
+        with lock:
+            if 'done' in state:
+                return
+            state['partial'] = partial
+        if progress:
+            progress(partial)
+
+    def target():
+        with metrics.tagged(request_id, profile):
+            try:
+                state['result'] = work(report)
+            except Exception as err:
+                state['error'] = err
+            finally:
+                slots.release()
+
+    runner = threading.Thread(target=target, name='summary-plan-{}'.format(request_id))
+    runner.daemon = True
+    try:
+        runner.start()
+    except Exception:
+        slots.release()
+        raise
+    runner.join(max(deadline - time.time(), 0))
+    with lock:
+        state['done'] = True
+    if runner.is_alive():
+        return (state['partial'] if 'partial' in state else fallback()), False
+    if 'error' in state:
+        raise state['error']
+    return state['result'], True
@@ -2,113 +2,280 @@
 import requests
 import json
 from config import *
-from ts_config import DEBUG, LOG_FILE, SUMMARY_INTERVALS, TEST_JSON, SUMMS
+from ts_config import (SUMMARY_INTERVALS, TEST_JSON, SUMMS, MESSAGE_STORE,
+                       STORE_RECONCILE_SECONDS, NLP_SOCKETS, NLP_TIMEOUT,
+                       SLACK_API_URL, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL,
+                       SUMMARY_DEADLINE)
+from message_store import MessageStore
+from summary_cache import SummaryCache
+from planner import Planner
+import planner
+from nlp_service import NlpClient
 from slacker import Slacker
 import slacker
 import logging
-import logging.handlers
+import log_queue
+from log_queue import capped
 import uuid
 import re
+import time
 import io
 from datetime import timedelta, datetime
-if "gensim" in SUMMS:
-    from ts_summarizer import TextRankTsSummarizer
-if "spacy" in SUMMS:
-    from sp_summarizer import SpacyTsSummarizer
+from engines import registry as engines
+from interval_summarizer import tspec_to_delta
+import metrics
+if SLACK_API_URL:
+    slacker.API_BASE_URL = SLACK_API_URL + u'{api}'
 
 class SlackRouter(object):
     expr = re.compile(r'-?(\d{1,3}?)\s+(\S{1,8})\s*(.*)$')
     plural = re.compile(r'([^s]+)s$')
     temporals = ['minute', 'min', 'hour', 'day', 'week']
+    _store = None
+    _nlp_client = None
+    _cache = None
+    _planner = None
 
 
     def __init__(self, test=False):
         self.test = test
         self.slack = None if self.test else slacker.Slacker(keys["slack"])
-        log_level = logging.DEBUG if DEBUG else logging.INFO
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh = logging.handlers.RotatingFileHandler('./slack_summary_'+LOG_FILE, mode='a', encoding='utf-8', maxBytes=1000000, backupCount=5,)
-        fh.setLevel(log_level)
-        fh.setFormatter(formatter)
+        log_queue.configure()
         self.logger = logging.getLogger('slack_summary')
-        self.logger.handlers = []
-        self.logger.setLevel(log_level)
-        self.logger.addHandler(fh)
+        self.store = None if self.test else SlackRouter.message_store()
+        self.cache = None if self.test else SlackRouter.summary_cache()
+
+    @classmethod
+    def message_store(cls):
+        """The process wide local history store, None when disabled"""
+        if MESSAGE_STORE and cls._store is None:
+            cls._store = MessageStore(MESSAGE_STORE)
+        return cls._store
+
+    @classmethod
+    def summary_cache(cls):
+        """The process wide cache of finished summaries, None when disabled"""
+        if SUMMARY_CACHE_SIZE and cls._cache is None:
+            cls._cache = SummaryCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL)
+        return cls._cache
+
+    @classmethod
+    def planner(cls):
+        """The process wide planner, its cost estimates learn from every request"""
+        if cls._planner is None:
+            cls._planner = Planner()
+        return cls._planner
+
+    @classmethod
+    def nlp_client(cls):
+        """Client of the standalone NLP service, None when engines run in process"""
+        if NLP_SOCKETS and cls._nlp_client is None:
+            cls._nlp_client = NlpClient(NLP_SOCKETS, timeout=NLP_TIMEOUT)
+        return cls._nlp_client
 
     def get_response(self, channel_id):
         self.logger.debug(u'Generating summary for channel: %s', channel_id)
         return self.slack.channels.history(channel_id)
 
-    def get_messages(self, channel_id, params):
-        """Get messages based upon the interval"""
-        tdelt = self.build_delta(params)
+    def get_messages(self, channel_id, params, tdelt=None):
+        """Get messages based upon the interval, or the longer `tdelt`"""
+        tdelt = tdelt or self.build_delta(params)
         earliest_time = datetime.now()-tdelt
         self.logger.debug(u'Earliest time %s', earliest_time)
         ts = u'{}.999999'.format(earliest_time.strftime("%s"))
         self.logger.debug(u'Channel id %s, TS string %s', channel_id, ts)
+        if not self.store:
+            msgs, complete = self._fetch_history(channel_id, ts, params)
+            return msgs
+        channel = self._channel_key(channel_id)
+        coverage = self.store.coverage(channel)
+        if coverage and coverage[0] <= float(ts):
+            # Only ask for what is newer than the local copy, going back far
+            # enough to pick up recent edits and deletions
+            fetch_from = max(float(ts), coverage[1] - STORE_RECONCILE_SECONDS)
+            fetch_ts = u'{:.6f}'.format(fetch_from)
+            self.logger.debug(u'Fetching delta from %s for %s', fetch_ts, channel)
+        else:
+            fetch_ts = ts
+        msgs, complete = self._fetch_history(channel_id, fetch_ts, params)
+        if not complete:
+            return msgs
+        self.store.replace(channel, float(fetch_ts), msgs)
+        msgs = self.store.messages(channel, float(ts))
+        self.logger.debug(u'Serving %s messages from the local store', len(msgs))
+        return msgs[:params['max_msgs']] if 'max_msgs' in params else msgs
+
+    def _fetch_history(self, channel_id, ts, params):
+        """
+        Page through the channel history from `ts`. Returns the messages and
+        whether all of them were retrieved.
+        """
+        with metrics.timed('fetch'):
+            msgs, complete, pages = self._page_history(channel_id, ts, params)
+        metrics.pages.observe(pages)
+        self.logger.debug(u'Summary request %s fetched %s messages in %s pages',
+                          metrics.current_request(), len(msgs), pages)
+        return msgs, complete
+
+    def _page_history(self, channel_id, ts, params):
         response =  self.slack.channels.history(channel_id, oldest=ts, count=999)
-	res = (response.body)
+        res = (response.body)
+        pages = 1
         add_more = True
         msgs = []
         msg_ids = set()
         while add_more:
             if 'max_msgs' in params and params['max_msgs'] <= len(msgs):
-                return msgs
+                return msgs, False, pages
             if u'messages' in res:
                 new_set = set([msg['ts'] for msg in res['messages']])
                 if len(new_set.intersection(msg_ids)) > 0:
                     self.logger.debug(u'Overlap in messages')
-                    return msgs
+                    return msgs, True, pages
                 msgs.extend(res['messages'])
                 msg_ids.update(new_set)
                 self.logger.debug(u'Got %s messages', len(msgs))
             else:
-                return msgs    
+                return msgs, True, pages
             if 'has_more' in res and res['has_more']:
                 self.logger.debug(u'Paging for more messages.')
                 response =  self.slack.channels.history(channel_id, oldest=ts, latest=res['messages'][-1]['ts'], count=999)
                 res = (response.body)
+                pages += 1
             else:
                 self.logger.debug(u'No more messages.')
                 add_more = False
-        return msgs
+        return msgs, True, pages
+
+    def _channel_key(self, channel_id):
+        """Flask hands the channel id over as a list of form values"""
+        return channel_id[0] if isinstance(channel_id, (list, tuple)) else channel_id
 
     def get_summary(self, **args):
+        """`deadline` optionally overrides SUMMARY_DEADLINE, in seconds from now"""
+        request_id = uuid.uuid1()
+        engine = args['engine'] if 'engine' in args else SUMMS[0]
+        args['deadline_at'] = time.time() + (args['deadline'] if 'deadline' in args else SUMMARY_DEADLINE)
+        with metrics.request(request_id, engine):
+            return self._get_summary(request_id, engine, args)
+
+    def _get_summary(self, request_id, engine, args):
         channel_id = args['channel_id'] if 'channel_id' in args else None
         channel_name = args['channel_name'] if 'channel_name' in args else None
         user_id = args['user_id'] if 'user_id' in args else None
         user_name = args['user_name'] if 'user_name' in args else None
         params = args['params'] if 'params' in args else None
-        request_id = uuid.uuid1()
-        response = None
-        msgs = None
+        windows = self.build_windows(params)
+        if self.cache is not None:
+            # Identical requests running at the same time share one fetch
+            # and summary, later ones reuse it until new messages arrive
+            window = tuple((tspec_to_delta(**w).total_seconds(), w.get('size')) for w in windows) if windows \
+                else self.build_delta(params).total_seconds()
+            flight = (self._channel_key(channel_id), engine, window)
+            summary = self.cache.single_flight(flight, lambda: self._cached_summary(flight, engine, windows, args))
+            self.logger.info(u'Summary request %s cache %s', request_id, self.cache.stats())
+        else:
+            msgs = self._fetch(windows, args)
+            summary, complete = self._summarize(engine, msgs, windows, args)
+        self.logger.info(u'Summary request %s user_id: %s', request_id, user_id)
+        self.logger.info(u'Summary request %s channel_name: %s', request_id, channel_name)
+        self.logger.info(u'Summary request %s parameters: %s', request_id, params)
+        self.logger.info(u'Summary request %s summary:\n %s', request_id, capped(summary))
+        return self.format_summary(summary)
+
+    def _cached_summary(self, flight, engine, windows, args):
+        msgs = self._fetch(windows, args)
+        newest = max([float(msg['ts']) for msg in msgs] + [0.0])
+        key = flight + (newest,)
+        summary = self.cache.get(key)
+        if summary is None:
+            summary, complete = self._summarize(engine, msgs, windows, args)
+            # A fallback or a cheaper engine's summary is not worth keeping
+            if complete:
+                self.cache.put(key, summary)
+                # Summaries of the same request made before the newest message
+                self.cache.invalidate(lambda k: k[:3] == flight and k[3] < newest)
+        return summary
+
+    def _fetch(self, windows, args):
+        channel_id = args['channel_id'] if 'channel_id' in args else None
+        params = args['params'] if 'params' in args else None
         if self.test:
             with io.open(TEST_JSON, encoding='utf-8') as iot:
                 msgs = json.load(iot)[u'messages']
+        elif windows:
+            # The longest window is fetched once and serves all of them
+            msgs = self.get_messages(channel_id, params, max(tspec_to_delta(**w) for w in windows))
         else:
             msgs = self.get_messages(channel_id, params)
+        metrics.messages.observe(len(msgs))
+        self.logger.debug(u'Summary request %s messages: %s', metrics.current_request(), capped(msgs))
+        return msgs
+
+    def _summarize(self, engine, msgs, windows, args):
+        """
+        The summary, and False when it is not the one the engine would give
+        without a deadline: the run missed it, or a cheaper engine was used
+        because the budget was short or every runner was busy.
+        """
+        channel_name = args['channel_name'] if 'channel_name' in args else None
+        progress = args['progress'] if 'progress' in args else None
         summ_object = args['summ']
-        summ_impl = None
-        summary = u''
-        if summ_object and "spacy" in SUMMS:
-            self.logger.info(u'Using spacy')
-            summ_impl = SpacyTsSummarizer()
+        if SlackRouter.nlp_client():
+            self.logger.info(u'Using the NLP service with %s', engine)
+            return SlackRouter.nlp_client().summarize_one(engine, msgs, channel=channel_name, windows=windows), True
+        names = ['simple']
+        if "gensim" in SUMMS:
+            names.append('textrank')
+        if summ_object and "spacy" in SUMMS and engine != 'gensim':
+            names.extend(['lsa', 'lsa_limited'])
+        count, kchars = planner.volume(msgs)
+        budget = args['deadline_at'] - time.time()
+        plan = SlackRouter.planner().plan(names, count, kchars, budget)
+        self.logger.info(u'Summary request %s plan %s (limit %s) estimated %.2fs of %.2fs for %s messages, %.1fk characters',
+                         metrics.current_request(), plan.name, plan.limit, plan.estimate, budget, count, kchars)
+        simple = self._engine('simple', channel_name)
+        summ_impl = self._engine(plan.engine, channel_name, summ_object)
+        summ_impl.set_candidate_limit(plan.limit)
+
+        def work(report):
+            summ_impl.set_progress(report)
+            return summ_impl.summarize_windows(msgs, windows) if windows else summ_impl.summarize(msgs)
+
+        def fallback():
+            return simple.summarize_windows(msgs, windows) if windows else simple.summarize(msgs)
+
+        forward = (lambda partial: progress(self.format_summary(partial))) if progress else None
+        start = time.time()
+        finished = True
+        if plan.name != 'simple':
+            try:
+                summary, finished = planner.run(work, args['deadline_at'], fallback, forward)
+            except planner.Busy:
+                self.logger.warn(u'Summary request %s has no free runner for plan %s, using simple',
+                                 metrics.current_request(), plan.name)
+                plan = SlackRouter.planner().plan(['simple'], count, kchars, budget)
+        if plan.name == 'simple':
+            summary = fallback()
+        elapsed = time.time() - start
+        if not finished:
+            # The run goes on past the deadline, its time is only known to exceed the budget
+            elapsed = max(elapsed, budget)
+            self.logger.warn(u'Summary request %s plan %s missed the deadline, serving the best finished summary',
+                             metrics.current_request(), plan.name)
+        SlackRouter.planner().observe(plan, elapsed, finished)
+        metrics.plans.inc(1, plan.name, 'complete' if finished else 'aborted')
+        return summary, finished and plan.engine == planner.ENGINES[planner.unlimited(names)]
+
+    def _engine(self, name, channel_name, summ_object=None):
+        summ_impl = engines.get(name)()
+        if name == 'spacy':
             summ_impl.set_summarizer(summ_object)
-        elif "gensim" in SUMMS:
-            self.logger.info(u'Using gensim')
-            summ_impl = TextRankTsSummarizer()
-        if summ_impl:
-            summ_impl.set_channel(channel_name)
-            summary = summ_impl.summarize(msgs)
-        else:
-            self.logger.warn(u'No summarizer was set!')
-        self.logger.info(u'Summary request %s user_id: %s', request_id, user_id)
-        self.logger.info(u'Summary request %s channel_name: %s', request_id, channel_name)
-        self.logger.info(u'Summary request %s parameters: %s', request_id, params)
-        self.logger.debug(u'Summary request %s messages: %s', request_id, msgs)
-        self.logger.info(u'Summary request %s summary:\n %s', request_id, summary)
-	res = u"*Chat Summary:* \n " + summary + "\n \n"
-        return res
+        summ_impl.set_channel(channel_name)
+        return summ_impl
+
+    def format_summary(self, summary):
+        return u"*Chat Summary:* \n " + summary + "\n \n"
 
     def _parse_args(self, commands):   
         units = None
@@ -144,6 +311,27 @@ class SlackRouter(object):
             interval['txt'] = u"Summary for last 5 days:\n"
         return [interval]
 
+    def build_windows(self, commands):
+        """
+        Range specs of a multi window summary, None for a single interval.
+        "intervals" asks for SUMMARY_INTERVALS, several intervals can also
+        be listed, e.g. "10 minutes, 12 hours, 5 days".
+        """
+        if not commands:
+            return None
+        if commands.split()[:1] == ['intervals']:
+            return [dict(spec) for spec in SUMMARY_INTERVALS]
+        parts = [part for part in re.split(r'[,/]', commands) if part.strip()]
+        if len(parts) < 2:
+            return None
+        windows = []
+        for part in parts:
+            unit, units, keywords = self._parse_args(part.strip())
+            if not unit:
+                return None
+            windows.append({unit + 's': units, 'size': 2})
+        return windows
+
     def build_delta(self, commands):
         """Return a single interval for the summarization"""
         unit, units, keywords = self._parse_args(commands)
@@ -1,31 +1,27 @@
 # -*- coding: utf-8 -*-
 from collections import namedtuple
+from operator import attrgetter
 from datetime import (timedelta, datetime)
 import re
 import logging
-import logging.handlers
+import time
 import sys
 import json
 import io
-from ts_config import TS_DEBUG, TS_LOG
+from log_queue import capped, VERBOSE
 import glob
-from utils import get_msg_text
-from interval_summarizer import (IntervalSpec, TsSummarizer,
-                                 canonicalize, ts_to_time, tspec_to_delta)
+from parse_cache import message_key
+from near_dupes import collapse, exact
+from candidates import select, select_windows
+from interval_summarizer import IntervalSpec, TsSummarizer, TimeIndex, SourceIndex
+import metrics
 logging.basicConfig(level=logging.INFO)
 
 class SpacyTsSummarizer(TsSummarizer):
     
     def __init__(self, ):
         TsSummarizer.__init__(self, )
-        log_level = logging.DEBUG if TS_DEBUG else logging.INFO
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh = logging.handlers.RotatingFileHandler('./spacy_'+TS_LOG, mode='a', encoding='utf-8', maxBytes=1000000, backupCount=5)
-        fh.setLevel(log_level)
-        fh.setFormatter(formatter)
         self.logger = logging.getLogger('sp_summarizer')
-        self.logger.handlers = []
-        self.logger.addHandler(fh)
 
     def set_summarizer(self, spacy_summ):
         self.sumr = spacy_summ
@@ -41,63 +37,95 @@ class SpacyTsSummarizer(TsSummarizer):
             self.logger.warn("No messages to form summary")
             return u"\n Unable to form summary here.\n"
         txt = range_spec['txt'] if range_spec else u'Summary is'
+        records = self.select(msgs, range_spec)
         if range_spec:
-            self.logger.info("First 10 messages  %s of %s", msgs[:10], len(msgs)) 
             self.logger.info("Using time range spec %s", range_spec)
-            start_time = time.strptime(range_spec['start'], "%B %d %Y") if 'start' in range_spec else ts_to_time(min(msgs, key=lambda m: m['ts'])['ts'])
-            self.logger.info("Start time is  %s", start_time)
-            delt = tspec_to_delta(**range_spec)
-            end_time = start_time + delt
-            self.logger.info("End time is  %s", end_time)
-            msgs = [msg for msg in msgs if ts_to_time(msg['ts']) >= start_time and ts_to_time(msg['ts']) <= end_time]
-            self.logger.info("First 10 messages  %s of %s", msgs[:10], len(msgs)) 
+            self.logger.info("First 10 messages  %s of %s", capped(records[:10]), len(records), extra=VERBOSE)
         summ = txt + u' '
-        summ_list = []
-        can_dict = {canonicalize(get_msg_text(msg)) : msg for msg in msgs}
-        top_keys = sorted(can_dict.keys(), key=lambda x: len(x.split()), reverse=True)
-        can_dict = {key: can_dict[key] for key in top_keys}
+        can_dict = {rec.text : rec for rec in exact(records)}
         self.logger.info("Length of can_dict is %s", len(can_dict))
-        simple_sum_list = [can_dict[ss] for ss in sorted(can_dict.keys(), key=lambda x: len(x.split()), reverse=True)[:size]]
-        simple_sum = u'\n'.join([self.tagged_sum(can_dict[ss]) for ss in sorted(can_dict.keys(), key=lambda x: len(x.split()), reverse=True)[:size]])
-        #simple_sum = u'\n'.join([self.tagged_sum(ss) for ss in simple_sum_list])
-        assert(len(simple_sum_list) <= size)
-        #simple_sum = self.tagged_sum(can_dict[max(can_dict.keys(), key=lambda x: len(x))]) 
-        if len(msgs) < 10:
+        simple_sum = self._simple_sum(can_dict.values(), size)
+        if len(records) < 10:
             #return the longest
-            summ += u'\n'.join([self.tagged_sum(ss) for ss in sorted(simple_sum_list, key=lambda x: x['ts'])])
+            summ += simple_sum
         else:
-            max_sents = {}
-            user_sents = {}
-            for (txt, msg) in can_dict.items():
-                if len(txt.split()) > 3:
-                    sl = list(self.sumr.nlp(txt).sents)
-                    max_sents[max(sl, key = lambda x: len(x)).text] = msg
-                    user_sents[max(sl, key = lambda x: len(x)).text] = msg['user'] if 'user' in msg else u''
-            txt_sum = [v for v in self.sumr(u' '.join(max_sents.keys()), size, user_sents)]
-            self.logger.info("Canonical keys are \n%s", u' '.join(can_dict.keys()))
-            self.logger.info("Spacy summ %s", txt_sum)
-            nlp_summ = u'\n'.join([self.tagged_sum(max_sents[ss]) for ss in txt_sum if len(ss) > 1 and ss in max_sents])
-            nlp_list = [max_sents[ss] for ss in txt_sum if len(ss) > 1 and ss in max_sents]
-            for ss in txt_sum:
-                if ss not in max_sents and len(ss.split()) > 5:
-                    self.logger.info("Searching for: %s", ss)
-                    for (ky, msg) in max_sents.items():
-                        if ss in ky or (len(ky.split()) > 10 and ky in ss) and len(nlp_list) <= size:
-                            nlp_summ += u'\n' + self.tagged_sum(msg)
-                            nlp_list.append(msg)
-            if len(nlp_list) < 2:
-                self.logger.info("Failed to find nlp summary using heuristic")
-                summ += u'\n'.join([self.tagged_sum(ss) for ss in sorted(simple_sum_list, key=lambda x: x['ts'])])
-            else:
-                self.logger.info("First msg is %s, %s", nlp_list[0], nlp_list[0]['ts'])
-                self.logger.info("Sorted is %s", sorted(nlp_list, key=lambda x: x['ts']))
-                summ += u'\n'.join([self.tagged_sum(ss) for ss in sorted(nlp_list, key=lambda x: x['ts'])])
-        self.logger.info("Summary for segment %s is %s", msgs, summ) 
+            self.report_progress(summ + simple_sum)
+            cands = collapse(sorted([rec for rec in can_dict.values() if rec.words > 3], key=attrgetter('ts')))
+            cands = select(cands, self.candidate_limit)
+            spans, sources, user_sents = self._parse_spans(cands)
+            txt_sum = [v for v in self.sumr(spans, size, user_sents)]
+            self.logger.info("Canonical keys are \n%s", capped(can_dict.keys()), extra=VERBOSE)
+            summ += self._nlp_sum(txt_sum, sources, size) or simple_sum
+        self.logger.info("Summary for segment of %s messages is %s", len(records), capped(summ))
         return summ
 
+    def summarize_windows(self, msgs, specs, end=None):
+        """
+        Shares the work between the windows: messages are normalized and
+        parsed once and the LSA term matrix is built once, so each extra
+        window only costs its SVD and ranking.
+        """
+        index = msgs if isinstance(msgs, TimeIndex) else TimeIndex(msgs)
+        end = time.time() if end is None else end
+        windows = [index.last_window(spec, end) for spec in specs]
+        # The windows all end now, so the largest holds every message and
+        # the newest message with a given text is in every window holding it
+        can_dict = {rec.text : rec for rec in exact(max(windows, key=len))} if windows else {}
+        cands = collapse(sorted([rec for rec in can_dict.values() if rec.words > 3], key=attrgetter('ts')))
+        cands = select_windows(cands, [window[0].ts for window in windows if len(window)], self.candidate_limit)
+        simple = [self._simple_sum(set(can_dict[rec.text] for rec in window), spec.get('size', 3))
+                  for (spec, window) in zip(specs, windows)]
+        self.report_progress(u'\n'.join(self._section(spec, window, summ)
+                                        for (spec, window, summ) in zip(specs, windows, simple)))
+        spans, sources, user_sents = self._parse_spans(cands)
+        span_ts = [sources[span.text].ts for span in spans]
+        ranked = [i for (i, window) in enumerate(windows) if len(window) >= 10]
+        cols = [[c for (c, ts) in enumerate(span_ts) if ts >= windows[i][0].ts] for i in ranked]
+        txt_sums = dict(zip(ranked, self.sumr.summarize_windows(
+            spans, user_sents, [(col, specs[i].get('size', 3)) for (i, col) in zip(ranked, cols)])))
+        sections = []
+        for (i, (spec, window)) in enumerate(zip(specs, windows)):
+            summ = simple[i]
+            if i in txt_sums:
+                summ = self._nlp_sum(txt_sums[i], sources, spec.get('size', 3)) or summ
+            sections.append(self._section(spec, window, summ))
+        summ = u'\n'.join(sections)
+        self.logger.info("Summary for %s windows of %s messages is %s", len(specs), len(index), capped(summ))
+        return summ
+
+    def _parse_spans(self, cands):
+        """
+        Parses each candidate exactly once and keeps its longest sentence
+        span; returns the distinct spans, a `SourceIndex` of the candidates
+        also finding each span's record, and the user of each span text.
+        """
+        sources = SourceIndex(cands)
+        user_sents = {}
+        spans = []
+        texts = [rec.text for rec in cands]
+        keys = [message_key(self.channel, rec.ts_id, rec.text) for rec in cands]
+        for (rec, doc) in zip(cands, self.sumr.parse(texts, keys)):
+            span = max(doc.sents, key = lambda x: len(x))
+            if span.text not in user_sents:
+                spans.append(span)
+            sources.alias(span.text, rec)
+            user_sents[span.text] = rec.user
+        return spans, sources, user_sents
+
+    def _nlp_sum(self, txt_sum, sources, size):
+        """The messages of the summary sentences, None if fewer than two are found"""
+        self.logger.info("Spacy summ %s", txt_sum)
+        nlp_list = sources.locate([ss for ss in txt_sum if len(ss) > 1], limit=size + 1)
+        if len(nlp_list) < 2:
+            self.logger.info("Failed to find nlp summary using heuristic")
+            return None
+        self.logger.info("First msg is %s, %s", nlp_list[0], nlp_list[0].ts_id)
+        with metrics.timed('format'):
+            return u'\n'.join([self.tagged_sum(ss) for ss in sorted(nlp_list, key=attrgetter('ts'))])
+
     def parify_text(self, msg_segment):
         ptext = u'. '.join([SpacyTsSummarizer.flrg.sub(u'', msg['text']) for msg in msg_segment if 'text' in msg])
-        self.logger.debug("Parified text is %s", ptext)
+        self.logger.debug("Parified text is %s", capped(ptext))
         return ptext
 
 def main():
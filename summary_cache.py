@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of finished summaries. Entries expire after a TTL and the least
+recently used are evicted past a size bound. `single_flight` makes
+concurrent callers with the same key share one computation.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SummaryCache(object):
+    """Thread safe LRU of at most `size` summaries, each kept `ttl` seconds"""
+
+    def __init__(self, size, ttl, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] < self.clock():
+                self.misses += 1
+                return None
+            self._data[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (self.clock() + self.ttl, value)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, match):
+        """Drop the entries whose key `match` accepts"""
+        with self._lock:
+            for key in [key for key in self._data if match(key)]:
+                del self._data[key]
+
+    def single_flight(self, key, compute):
+        """
+        Result of `compute()`. While one call for `key` runs, other callers
+        with the same key wait for its result (or its exception).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = compute()
+            return flight.value
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic Slack channel histories for benchmarks and load
+tests. Messages come newest first like `channels.history` and mix plain
+chat with attachments, code blocks, links, emoji and HTML entities.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+from bisect import bisect_left, bisect_right
+import random
+import time
+
+WORDS = (u"deploy server index query shard cluster error timeout cache "
+         u"release branch review test build patch request response latency "
+         u"search ticket customer user plugin theme site blog post page "
+         u"database migration backup alert monitor graph metric memory cpu "
+         u"network config token limit queue worker job schedule meeting "
+         u"design feedback issue bug fix rollback merge ship launch").split()
+FILLER = (u"the a we it is was should could will can why what how this that "
+          u"to for on in with from and but so just maybe really").split()
+EMOJI = [u':smile:', u':+1:', u':tada:', u':fire:', u':eyes:']
+
+
+class SyntheticChannel(object):
+    """
+    `users` distinct posters; the `*_rate` arguments are the fractions of
+    messages carrying an attachment, a code block or a link. The history
+    spans `days` days ending at `end` (defaults to now).
+    """
+
+    def __init__(self, users=20, attachment_rate=0.05, code_rate=0.05,
+                 link_rate=0.1, days=5, end=None, seed=0):
+        self.users = [u'U{:08d}'.format(i) for i in range(users)]
+        self.attachment_rate = attachment_rate
+        self.code_rate = code_rate
+        self.link_rate = link_rate
+        self.days = days
+        self.end = end if end is not None else time.time()
+        self.rng = random.Random(seed)
+
+    def sentence(self, words=None):
+        rng = self.rng
+        count = words or rng.randint(3, 25)
+        toks = [rng.choice(WORDS) if rng.random() < 0.4 else rng.choice(FILLER)
+                for _ in range(count)]
+        return u' '.join(toks) + rng.choice([u'.', u'.', u'?', u'!', u''])
+
+    def text(self):
+        rng = self.rng
+        parts = [self.sentence() for _ in range(rng.choice([1, 1, 1, 2, 3]))]
+        if rng.random() < self.link_rate:
+            parts.append(u'<http://example.com/{}/{}>'.format(rng.choice(WORDS), rng.randint(1, 9999)))
+        if rng.random() < self.code_rate:
+            parts.append(u'```{} = {}({})```'.format(rng.choice(WORDS), rng.choice(WORDS), rng.randint(0, 99)))
+        if rng.random() < 0.05:
+            parts.append(rng.choice(EMOJI))
+        if rng.random() < 0.02:
+            parts.append(u'&amp; more')
+        return u' '.join(parts)
+
+    def message(self, ts):
+        rng = self.rng
+        msg = {u'type': u'message', u'ts': u'{:.6f}'.format(ts)}
+        if rng.random() < 0.02:
+            msg[u'bot_id'] = u'B{:08d}'.format(rng.randint(0, 9))
+            msg[u'username'] = u'bot'
+        else:
+            msg[u'user'] = rng.choice(self.users)
+        if rng.random() < self.attachment_rate:
+            msg[u'text'] = u''
+            msg[u'attachments'] = [{u'title': self.sentence(6), u'text': self.text()}]
+        else:
+            msg[u'text'] = self.text()
+        return msg
+
+    def messages(self, count):
+        """`count` messages evenly spread over the history, newest first"""
+        start = self.end - self.days * 86400
+        step = (self.end - start) / max(count, 1)
+        return [self.message(start + (count - i) * step) for i in range(count)]
+
+
+class ChannelHistory(object):
+    """Pages through a message list the way `channels.history` does"""
+    MAX_COUNT = 1000
+
+    def __init__(self, msgs):
+        self.msgs = sorted(msgs, key=lambda m: float(m['ts']))
+        self.ts = [float(m['ts']) for m in self.msgs]
+
+    def page(self, oldest=None, latest=None, count=100):
+        """
+        Body of a history response: up to `count` messages with
+        oldest < ts < latest, newest first, and whether more remain.
+        """
+        lo = bisect_right(self.ts, float(oldest)) if oldest else 0
+        hi = bisect_left(self.ts, float(latest)) if latest else len(self.ts)
+        count = min(int(count), ChannelHistory.MAX_COUNT)
+        start = max(lo, hi - count)
+        return {u'ok': True, u'messages': self.msgs[start:hi][::-1],
+                u'has_more': start > lo}
@@ -0,0 +1,58 @@
+import unittest
+import shutil
+import tempfile
+from parse_cache import (LruCache, DiskCache, ParseCache, message_key)
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_message_key(self):
+        """Edited text gives a new key"""
+        key = message_key('elasticsearch', '1441925382.000186', u'hello there')
+        self.assertEqual(key, message_key('elasticsearch', '1441925382.000186', u'hello there'))
+        self.assertNotEqual(key, message_key('elasticsearch', '1441925382.000186', u'hello here'))
+        self.assertNotEqual(key, message_key('general', '1441925382.000186', u'hello there'))
+
+    def test_lru_eviction(self):
+        lru = LruCache(2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.put('c', 3)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(len(lru), 2)
+
+    def test_disk_eviction(self):
+        disk = DiskCache(self.path, 25)
+        disk.put(u'a', b'x' * 10)
+        disk.put(u'b', b'y' * 10)
+        self.assertEqual(disk.get(u'a'), b'x' * 10)
+        disk.put(u'c', b'z' * 10)
+        self.assertEqual(disk.get(u'b'), None)
+        self.assertEqual(disk.get(u'a'), b'x' * 10)
+        self.assertEqual(disk.bytes, 20)
+        # A new instance picks up what is already on disk
+        self.assertEqual(len(DiskCache(self.path, 25)), 2)
+
+    def test_two_tiers(self):
+        cache = ParseCache(1, self.path, 1000, dumps=lambda v: v.encode('utf-8'),
+                           loads=lambda d: d.decode('utf-8'))
+        self.assertEqual(cache.get(u'k1'), None)
+        cache.put(u'k1', u'parse one')
+        cache.put(u'k2', u'parse two')
+        self.assertEqual(cache.get(u'k2'), u'parse two')
+        self.assertEqual(cache.get(u'k1'), u'parse one')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['disk_hits'], stats['misses']), (1, 1, 1))
+        self.assertEqual(stats['disk_entries'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,11 @@
 import unittest
+import os
+import tempfile
+import ts_config
+# The history store and the parse cache of the tests stay out of the checkout
+TEST_DIR = tempfile.mkdtemp()
+ts_config.MESSAGE_STORE = os.path.join(TEST_DIR, 'message_store.db')
+ts_config.PARSE_CACHE_DIR = os.path.join(TEST_DIR, 'parse_cache')
 import mock
 from mock import MagicMock, patch
 from slacker import Slacker
@@ -7,12 +14,72 @@ import main
 from slack_summary import SlackRouter
 from requests import Response
 import config
-from ts_config import DEBUG, LOG_FILE
+from ts_config import DEBUG, LOG_FILE, SUMMARY_INTERVALS
 import sys
 import logging
 import logging.handlers
+import pstats
 import json
 import io
+import shutil
+import time
+import threading
+import BaseHTTPServer
+import Queue
+from message_store import MessageStore
+from summary_cache import SummaryCache
+from planner import Planner
+import planner
+from job_pool import JobPool
+from nlp_service import NlpServer, NlpClient, NlpServiceError
+from engines import EngineRegistry
+from synthetic_channel import SyntheticChannel
+from bench_stages import FakeSlack, regressions, main as bench_main
+from fake_slack import FakeSlackServer
+import load_test
+import metrics
+from log_queue import (capped, QueueHandler, QueueListener,
+                       SamplingFilter, VERBOSE)
+
+class ResponseReceiver(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Local stand-in for a Slack response_url"""
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        self.server.received.put(json.loads(self.rfile.read(length)))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def tearDownModule():
+    shutil.rmtree(TEST_DIR)
+
+
+def recent(body):
+    """The mocked history moved in time so its newest message is a minute old"""
+    shift = time.time() - 60 - max(float(msg['ts']) for msg in body['messages'])
+    for msg in body['messages']:
+        msg['ts'] = u'{:.6f}'.format(float(msg['ts']) + shift)
+    return body
+
+
+def start_receiver():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ResponseReceiver)
+    server.received = Queue.Queue()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}/response'.format(server.server_address[1])
+
+
+class EchoEngines(object):
+    """Stand-in for the NLP engines"""
+    def summarize(self, engine, msgs, channel=None, range_spec=None):
+        if engine == 'broken':
+            raise ValueError('broken engine')
+        return u'{} {} {}'.format(engine, channel, len(msgs))
+
 
 class Test(unittest.TestCase):
     def setUp(self):
@@ -24,12 +91,12 @@ class Test(unittest.TestCase):
         self.fh.setFormatter(formatter)
         self.logger.handlers = []
         self.logger.addHandler(self.fh)
-        self.expected = {u'has_more': True, u'messages': [{u'text': u'hmmm...',
+        self.expected = recent({u'has_more': True, u'messages': [{u'text': u'hmmm...',
                        u'ts': u'1414028037.000317',
                        u'type': u'message',
-                       u'user': u'U027LSDDA'}], u'ok': True}
+                       u'user': u'U027LSDDA'}], u'ok': True})
         with io.open('./data/test-events-elastic.json', encoding='utf-8') as jf:
-            self.larger_expected = json.load(jf)
+            self.larger_expected = recent(json.load(jf))
         self.myresponse = Response()
         self.myresponse.body = self.expected
         self.myresponse.status_code = 200
@@ -42,10 +109,451 @@ class Test(unittest.TestCase):
         self.channel_mock2 = MagicMock(**attrs2)
         main.app.config['TESTING'] = True
         self.app = main.app.test_client()
+        # Every test starts with an empty history store and summary cache
+        self.store_dir = tempfile.mkdtemp(dir=TEST_DIR)
+        SlackRouter._store = MessageStore(os.path.join(self.store_dir, 'store.db'))
+        SlackRouter._cache = None
 
     def tearDown(self):
-        pass
+        SlackRouter._store = None
+        SlackRouter._cache = None
+        shutil.rmtree(self.store_dir)
+
+    def assertSummarizes(self, text, body):
+        """`text` is a summary holding some of the messages of the mocked history"""
+        self.assertTrue(text.startswith(u'*Chat Summary:*'), text)
+        self.assertTrue(any(u'/p' + msg['ts'].replace(u'.', u'') in text for msg in body['messages']), text)
     
+    def test_build_windows(self):
+        """Several intervals in one command ask for a multi window summary"""
+        router = SlackRouter(test=True)
+        self.assertEqual(router.build_windows(u'10 minutes, 12 hours / 5 days'),
+                         [{'minutes': 10, 'size': 2}, {'hours': 12, 'size': 2}, {'days': 5, 'size': 2}])
+        self.assertEqual(router.build_windows(u'intervals'), SUMMARY_INTERVALS)
+        self.assertEqual(router.build_windows(u'5 days'), None)
+        self.assertEqual(router.build_windows(u'5 days, elasticsearch'), None)
+        self.assertEqual(router.build_windows(u''), None)
+
+    def test_summary_cache(self):
+        """Entries expire, are bounded and concurrent misses compute once"""
+        now = [0.0]
+        cache = SummaryCache(2, 10, clock=lambda: now[0])
+        cache.put(('C1', 'spacy', 1.0, 5.0), u'a')
+        cache.put(('C1', 'spacy', 1.0, 6.0), u'b')
+        cache.invalidate(lambda k: k[:3] == ('C1', 'spacy', 1.0) and k[3] < 6.0)
+        self.assertEqual(cache.get(('C1', 'spacy', 1.0, 5.0)), None)
+        self.assertEqual(cache.get(('C1', 'spacy', 1.0, 6.0)), u'b')
+        cache.put('x', 1)
+        cache.put('y', 2)
+        self.assertEqual(cache.get(('C1', 'spacy', 1.0, 6.0)), None)
+        now[0] = 11.0
+        self.assertEqual(cache.get('y'), None)
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return u'summary'
+        results = Queue.Queue()
+        leader = threading.Thread(target=lambda: results.put(cache.single_flight('k', compute)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.put(cache.single_flight('k', compute)))
+                     for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while cache.coalesced < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual([results.get(timeout=1) for _ in range(4)], [u'summary'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertRaises(ValueError, cache.single_flight, 'k', lambda: int('x'))
+
+    def test_planner(self):
+        """The best plan fitting the budget runs, a late one yields its last report and is avoided"""
+        costs = {'simple': (0.0, 0.0001, 0.0), 'textrank': (0.1, 0.001, 0.0),
+                 'lsa_limited': (0.5, 0.0001, 0.1), 'lsa': (0.5, 0.0001, 0.1)}
+        plans = Planner(costs, min_candidates=50, max_candidates=400)
+        names = ['simple', 'textrank', 'lsa', 'lsa_limited']
+        self.assertEqual(plans.plan(names, 100, 10, 5.0).name, 'lsa')
+        limited = plans.plan(names, 10000, 1000, 10.0)
+        self.assertEqual((limited.name, limited.limit), ('lsa_limited', 400))
+        self.assertEqual(plans.plan(names, 10000, 1000, 5.0).limit, 350)
+        self.assertEqual(plans.plan(names, 10000, 1000, 1.0).name, 'simple')
+        self.assertEqual(plans.plan(['simple', 'textrank'], 100, 10, 5.0).name, 'textrank')
+        best = plans.plan(names, 100, 10, 5.0)
+        plans.observe(best, best.estimate * 2)
+        self.assertEqual(round(plans.scale['lsa'], 3), 1.2)
+        for miss in range(4):
+            missed = plans.plan(names[:3], 100, 10, 5.0)
+            self.assertEqual(missed.name, 'lsa')
+            plans.observe(missed, 5.0, complete=False)
+        self.assertEqual(plans.plan(names[:3], 100, 10, 5.0).name, 'textrank')
+        self.assertEqual(planner.volume([{'text': u'abc'}, {'text': u'de'}]), (2, 0.005))
+        release = threading.Event()
+        def slow(report):
+            report(u'simple summary')
+            release.wait(5)
+            return u'nlp summary'
+        reports = []
+        self.assertEqual(planner.run(slow, time.time() + 0.1, lambda: u'fallback', reports.append),
+                         (u'simple summary', False))
+        release.set()
+        self.assertEqual(reports, [u'simple summary'])
+        self.assertEqual(planner.run(lambda report: u'done', time.time() + 5, lambda: u'fallback'), (u'done', True))
+        late = threading.Event()
+        self.assertEqual(planner.run(lambda report: late.wait(5), time.time() - 1, lambda: u'fallback'),
+                         (u'fallback', False))
+        late.set()
+        self.assertRaises(ValueError, planner.run, lambda report: int('x'), time.time() + 5, lambda: u'')
+        slots = threading.BoundedSemaphore(1)
+        held = threading.Event()
+        self.assertEqual(planner.run(lambda report: held.wait(5), time.time() + 0.1, lambda: u'fallback',
+                                     slots=slots), (u'fallback', False))
+        self.assertRaises(planner.Busy, planner.run, lambda report: u'done', time.time() + 5, lambda: u'', slots=slots)
+        held.set()
+        slots.acquire()
+        slots.release()
+        self.assertEqual(planner.run(lambda report: u'done', time.time() + 5, lambda: u'', slots=slots), (u'done', True))
+
+    @mock.patch('slack_summary.SUMMS', ['gensim'])
+    def test_degraded_summary(self):
+        """A summary by a cheaper engine than the one planned without a deadline is neither complete nor cached"""
+        sr = SlackRouter(test=True)
+        sr.cache = SummaryCache(10, 60)
+        late = {'summ': None, 'params': u'', 'deadline_at': time.time() - 1}
+        summary = sr._cached_summary(('C1', 'gensim', 432000.0), 'gensim', None, late)
+        self.assertTrue(summary.startswith(u'Summary is'))
+        self.assertEqual(sr.cache.stats()['size'], 0)
+        msgs = SyntheticChannel(users=5, days=1, seed=4).messages(200)
+        busy = threading.BoundedSemaphore(1)
+        busy.acquire()
+        with mock.patch('planner.runners', busy):
+            summary, complete = sr._summarize('gensim', msgs, None, {'summ': None, 'deadline_at': time.time() + 60})
+        self.assertFalse(complete)
+        with mock.patch('slack_summary.SUMMS', []):
+            summary, complete = sr._summarize('gensim', msgs, None, {'summ': None, 'deadline_at': time.time() - 1})
+        self.assertTrue(complete)
+
+    def test_message_store(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            store = MessageStore(os.path.join(tmp, 'store.db'))
+            self.assertEqual(store.coverage('C1'), None)
+            store.replace('C1', 100.0, [{'ts': '101.000001', 'text': 'a'},
+                                        {'ts': '102.000001', 'text': 'b'}])
+            store.replace('C1', 102.0, [{'ts': '102.000001', 'text': 'b edited'},
+                                        {'ts': '103.000001', 'text': 'c'}])
+            self.assertEqual(store.coverage('C1'), (100.0, 103.000001))
+            self.assertEqual([m['text'] for m in store.messages('C1', 100.0)], ['c', 'b edited', 'a'])
+            store.replace('C1', 102.5, [])
+            self.assertEqual([m['text'] for m in store.messages('C1', 101.5)], ['b edited'])
+            store.replace('C1', 200.0, [{'ts': '201.000001', 'text': 'd'}])
+            self.assertEqual(store.coverage('C1'), (200.0, 201.000001))
+            self.assertEqual([m['text'] for m in store.messages('C1', 0)], ['d'])
+        finally:
+            shutil.rmtree(tmp)
+
+    @mock.patch('slacker.Slacker')
+    def test_stale_store_coverage(self, mock_slack):
+        """A short window past the stored history does not leave a hole for longer ones"""
+        now = time.time()
+        history = [{u'text': u'message {}'.format(i), u'ts': u'{:.6f}'.format(now - 600 * i - 60), u'user': u'U1'}
+                   for i in range(288)]
+        def channel_history(channel, oldest=None, latest=None, count=None):
+            resp = Response()
+            resp.body = {u'has_more': False, u'ok': True,
+                         u'messages': [msg for msg in history if float(msg[u'ts']) >= float(oldest)]}
+            return resp
+        mock_slack.return_value.channels = MagicMock(**{'history.side_effect': channel_history})
+        tmp = tempfile.mkdtemp()
+        try:
+            sr = SlackRouter()
+            sr.store = MessageStore(os.path.join(tmp, 'store.db'))
+            sr.store.replace('C1', now - 4 * 86400, [{u'text': u'old', u'ts': u'{:.6f}'.format(now - 3 * 86400)}])
+            self.assertEqual(len(sr.get_messages('C1', '10 minutes')), 1)
+            self.assertEqual(len(sr.get_messages('C1', '2 days')), 288)
+        finally:
+            shutil.rmtree(tmp)
+
+    @mock.patch('slacker.Slacker')
+    def test_incremental_fetch(self, mock_slack):
+        """The second request only asks Slack for the recent delta"""
+        now = time.time()
+        body = {u'has_more': False, u'ok': True, u'messages': [
+            {u'text': u'newer', u'ts': u'{:.6f}'.format(now - 60), u'user': u'U1'},
+            {u'text': u'older', u'ts': u'{:.6f}'.format(now - 7200), u'user': u'U2'}]}
+        resp = Response()
+        resp.body = body
+        mock_slack.return_value.channels = MagicMock(**{'history.return_value': resp})
+        tmp = tempfile.mkdtemp()
+        try:
+            sr = SlackRouter()
+            sr.store = MessageStore(os.path.join(tmp, 'store.db'))
+            self.assertEqual(len(sr.get_messages('C1', '1 day')), 2)
+            self.assertEqual(len(sr.get_messages('C1', '1 day')), 2)
+            history = mock_slack.return_value.channels.history
+            first, second = [float(c[1]['oldest']) for c in history.call_args_list]
+            self.assertTrue(second > first)
+            self.assertTrue(second >= now - 60 - 3600 - 1)
+        finally:
+            shutil.rmtree(tmp)
+
+    @mock.patch('slacker.Slacker')
+    def test_deferred_service(self, mock_slack):
+        """The command is acknowledged and the summary is posted to response_url"""
+        mock_slack.return_value.channels = self.channel_mock2
+        server, url = start_receiver()
+        try:
+            rv = self.app.post('/slack', data=dict(
+                        channel_id='elasticsearch',
+                        channel_name='elasticsearch',
+                        user_id='user123456',
+                        user_name='bob2',
+                        text='2 days',
+                        response_url=url
+                    ), follow_redirects=True)
+            self.assertTrue(rv.status_code == 200)
+            self.assertEqual(rv.data.decode('utf-8'), main.DEFERRED_ACK)
+            posted = server.received.get(timeout=60)
+            self.assertSummarizes(posted['text'], self.larger_expected)
+        finally:
+            server.shutdown()
+
+    def test_job_pool_timeout(self):
+        server, url = start_receiver()
+        try:
+            pool = JobPool(1, 1, 0.2)
+            release = threading.Event()
+            self.assertTrue(pool.submit(lambda progress: release.wait(5) and u'late', url))
+            self.assertEqual(server.received.get(timeout=5)['text'], JobPool.timeout_text)
+            self.assertTrue(pool.submit(lambda progress: u'done', url))
+            self.assertEqual(server.received.get(timeout=5)['text'], u'done')
+            release.set()
+        finally:
+            server.shutdown()
+
+    def test_job_pool_runners(self):
+        """Jobs past their timeout hold their runner, new jobs wait and then are rejected"""
+        server, url = start_receiver()
+        try:
+            pool = JobPool(1, 1, 0.1, runners=2)
+            release = threading.Event()
+            for late in range(2):
+                self.assertTrue(pool.submit(lambda progress: release.wait(5) and u'late', url))
+                self.assertEqual(server.received.get(timeout=5)['text'], JobPool.timeout_text)
+            self.assertTrue(pool.submit(lambda progress: u'first', url))
+            self.assertRaises(Queue.Empty, server.received.get, timeout=0.5)
+            self.assertTrue(pool.submit(lambda progress: u'second', url))
+            self.assertFalse(pool.submit(lambda progress: u'rejected', url))
+            release.set()
+            self.assertEqual(server.received.get(timeout=5)['text'], u'first')
+            self.assertEqual(server.received.get(timeout=5)['text'], u'second')
+        finally:
+            release.set()
+            server.shutdown()
+
+    def test_job_pool_progress(self):
+        """The quick summary is posted first and then replaced by the refined one"""
+        server, url = start_receiver()
+        try:
+            pool = JobPool(1, 1, 0.5)
+            release = threading.Event()
+            def job(progress):
+                progress(u'quick')
+                return u'refined'
+            self.assertTrue(pool.submit(job, url))
+            self.assertEqual(server.received.get(timeout=5), {u'text': u'quick', u'replace_original': True})
+            self.assertEqual(server.received.get(timeout=5), {u'text': u'refined', u'replace_original': True})
+            def slow_job(progress):
+                progress(u'quick')
+                release.wait(5)
+                return u'late'
+            self.assertTrue(pool.submit(slow_job, url))
+            self.assertEqual(server.received.get(timeout=5)['text'], u'quick')
+            self.assertRaises(Queue.Empty, server.received.get, True, 1)
+            release.set()
+        finally:
+            server.shutdown()
+
+    def test_ready(self):
+        """Readiness is only reported after the model is warmed up"""
+        main.ready = False
+        self.assertEqual(self.app.get('/ready').status_code, 503)
+        main.warm_up()
+        rv = self.app.get('/ready')
+        self.assertEqual(rv.status_code, 200)
+        report = json.loads(rv.data.decode('utf-8'))
+        self.assertTrue(report['ready'])
+        self.assertTrue(report['rss_kb'] > 0)
+
+    def test_metrics(self):
+        """Stage timings and page counts show up on /metrics"""
+        msgs = SyntheticChannel(users=5, days=1, seed=3).messages(2500)
+        router = SlackRouter(test=True)
+        router.slack = FakeSlack(msgs)
+        before = metrics.pages.count()
+        with metrics.request('req-1', 'test'):
+            with metrics.timed('unit'):
+                fetched, complete = router._fetch_history('CTEST', u'0', {})
+        self.assertEqual(len(fetched), 2500)
+        self.assertEqual(metrics.pages.count(), before + 1)
+        self.assertEqual(metrics.current_request(), None)
+        rv = self.app.get('/metrics')
+        self.assertEqual(rv.status_code, 200)
+        text = rv.data.decode('utf-8')
+        self.assertIn(u'summary_stage_seconds_count{stage="fetch"}', text)
+        self.assertIn(u'summary_stage_seconds_bucket{stage="unit",le="+Inf"} 1', text)
+        self.assertIn(u'summary_history_pages_sum', text)
+        self.assertIn(u'summary_requests_total{engine="test"}', text)
+
+    def test_request_profile(self):
+        """A profiled request keeps the profile of its engine run, also of one finishing late"""
+        tmp = tempfile.mkdtemp()
+        try:
+            def engine_work(report):
+                return sum(range(1000))
+            release = threading.Event()
+            def late_work(report):
+                release.wait(5)
+            with mock.patch.multiple(metrics, PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_SECONDS=0, PROFILE_DIR=tmp):
+                with metrics.request('req-prof', 'test'):
+                    planner.run(engine_work, time.time() + 5, lambda: u'')
+                with metrics.request('req-late', 'test'):
+                    planner.run(late_work, time.time() + 0.1, lambda: u'')
+                release.set()
+                late = os.path.join(tmp, 'req-late.late.prof')
+                for wait in range(50):
+                    if os.path.exists(late):
+                        break
+                    time.sleep(0.1)
+            functions = lambda fname: [func[2] for func in pstats.Stats(os.path.join(tmp, fname)).stats]
+            self.assertIn('engine_work', functions('req-prof.prof'))
+            self.assertNotIn('late_work', functions('req-late.prof'))
+            self.assertIn('late_work', functions('req-late.late.prof'))
+        finally:
+            release.set()
+            shutil.rmtree(tmp)
+
+    def test_log_queue(self):
+        """Records are written by the listener thread, payloads are capped, a full queue drops"""
+        records = Queue.Queue(10)
+        received = []
+        class Collect(logging.Handler):
+            def emit(self, record):
+                received.append(self.format(record))
+        handler = QueueHandler(records)
+        handler.addFilter(SamplingFilter(0.0))
+        listener = QueueListener(records, [Collect()], {})
+        logger = logging.getLogger('test_log_queue')
+        logger.handlers = [handler]
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        # Nothing is written until the listener starts, so the queue fills up
+        logger.info(u'Messages %s', capped(range(100000), 50))
+        logger.info(u'Dropped %s', capped(range(10)), extra=VERBOSE)
+        for i in range(20):
+            logger.info(u'Flood %s', i)
+        self.assertEqual(handler.dropped, 11)
+        listener.start()
+        listener.stop()
+        self.assertTrue(received[0].startswith(u'Messages [100000 items] 0 1 2'))
+        self.assertTrue(len(received[0]) < 70)
+        self.assertEqual(received[1:], [u'Flood {}'.format(i) for i in range(9)])
+
+    def test_nlp_service(self):
+        """Batched jobs go over the socket and come back in order"""
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'nlp.sock')
+            server = NlpServer(path, EchoEngines())
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            client = NlpClient([os.path.join(tmp, 'missing.sock'), path], timeout=10)
+            jobs = [{'engine': 'spacy', 'msgs': self.larger_expected['messages'], 'channel': 'elasticsearch'},
+                    {'engine': 'gensim', 'msgs': [], 'channel': 'general'}]
+            self.assertEqual(client.summarize(jobs), [u'spacy elasticsearch {}'.format(len(self.larger_expected['messages'])),
+                                                      u'gensim general 0'])
+            self.assertEqual(client.summarize_one('gensim', [{}], 'c'), u'gensim c 1')
+            self.assertRaises(NlpServiceError, client.summarize_one, 'broken', [])
+            server.shutdown()
+            server.server_close()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_engine_registry(self):
+        """Engines are resolved on first use and shared ones built once"""
+        registry = EngineRegistry()
+        registry.register('decoder', 'json', 'JSONDecoder', shared=True)
+        registry.register('counter', 'collections', 'Counter')
+        self.assertFalse(registry.loaded('decoder'))
+        decoder = registry.get('decoder')
+        self.assertTrue(registry.get('decoder') is decoder)
+        self.assertEqual(registry.get('counter')('aab')['a'], 2)
+        self.assertEqual(sorted(registry.warm_up().keys()), ['counter', 'decoder'])
+
+    def test_paging_synthetic(self):
+        """get_messages pages through a whole synthetic window"""
+        channel = SyntheticChannel(seed=3, days=2)
+        msgs = channel.messages(2500)
+        sr = SlackRouter(test=True)
+        sr.slack = FakeSlack(msgs)
+        fetched = sr.get_messages('CBENCH', '3 days')
+        self.assertEqual(len(fetched), len(msgs))
+        self.assertEqual(len(set(msg['ts'] for msg in fetched)), len(msgs))
+        self.assertEqual(sr.slack.channels.calls, 3)
+
+    def test_fake_slack_load(self):
+        """The app pages through the fake Slack API under concurrent load"""
+        msgs = SyntheticChannel(seed=5, days=2).messages(1500)
+        server = FakeSlackServer(('127.0.0.1', 0), msgs, latency=0.01)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base_url = slacker.API_BASE_URL
+        slacker.API_BASE_URL = server.api_url + '{api}'
+        try:
+            sr = SlackRouter()
+            sr.store = None
+            self.assertEqual(len(sr.get_messages('CLOAD', '3 days')), len(msgs))
+            self.assertEqual(server.requests, 2)
+            report = load_test.run(load_test.app_sender, 6, 3, 'CLOAD', ['2 days', '1 day gensim'])
+            self.assertEqual((report['requests'], report['errors']), (6, 0))
+            self.assertTrue(report['p50'] <= report['p95'] <= report['p99'])
+            server.rate_limit = 1.0
+            report = load_test.run(load_test.app_sender, 2, 1, 'CLOAD', ['2 days'])
+            self.assertEqual(report['error_rate'], 1.0)
+            self.assertEqual(server.limited, 2)
+        finally:
+            slacker.API_BASE_URL = base_url
+            server.shutdown()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([load_test.percentile(values, p) for p in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(load_test.percentile([3.0], 99), 3.0)
+
+    def test_bench_regressions(self):
+        baseline = {'1000': {'stages': {'parse': 1.0, 'svd': 0.5}}}
+        results = {'1000': {'stages': {'parse': 1.1, 'svd': 0.9, 'format': 0.2}}}
+        self.assertEqual(regressions(results, baseline, 0.25), [('1000', 'svd', 0.9, 0.5)])
+
+    def test_bench_missing_baseline(self):
+        """Without a recorded baseline the run is kept and nothing is compared"""
+        tmp = tempfile.mkdtemp()
+        try:
+            output = os.path.join(tmp, 'results.json')
+            self.assertEqual(bench_main(['--sizes', '50', '--engines', 'none', '--output', output,
+                                         '--baseline', os.path.join(tmp, 'baseline.json')]), 0)
+            self.assertEqual(json.load(open(output))['50']['messages'], 50)
+        finally:
+            shutil.rmtree(tmp)
+
     @mock.patch('slacker.Slacker')
     def test_summary(self, mock_slack):
         mock_slack.return_value.channels = self.channel_mock
@@ -66,6 +574,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.expected)
 
     @mock.patch('slacker.Slacker')
     def test_service_lr(self, mock_slack):
@@ -81,6 +590,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.larger_expected)
 
     @mock.patch('slacker.Slacker')
     def test_service_no_command(self, mock_slack):
@@ -96,6 +606,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.larger_expected)
 
     @mock.patch('slacker.Slacker')
     def test_service_no_text(self, mock_slack):
@@ -110,6 +621,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.larger_expected)
 
     @mock.patch('slacker.Slacker')
     def test_service_bad_text(self, mock_slack):
@@ -125,6 +637,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.larger_expected)
 
     @mock.patch('slacker.Slacker')
     def test_service_bad_units(self, mock_slack):
@@ -140,6 +653,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.larger_expected)
 
     @mock.patch('slacker.Slacker')
     def test_gensim(self, mock_slack):
@@ -155,6 +669,7 @@ class Test(unittest.TestCase):
         self.logger.addHandler(self.fh)
         self.logger.info("Response is %s", rv.data)
         self.assertTrue(rv.status_code == 200)
+        self.assertSummarizes(rv.data.decode('utf-8'), self.larger_expected)
         
 
 if __name__ == '__main__':
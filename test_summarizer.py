@@ -3,16 +3,24 @@ import json
 import io
 import config
 from ts_config import SUMMS
-from interval_summarizer import (IntervalSpec, TsSummarizer,
-                                 ts_to_time)
+from interval_summarizer import (IntervalSpec, TsSummarizer, SimpleTsSummarizer,
+                                 ts_to_time, canonicalize, MessageRecord,
+                                 message_records, TimeIndex, SourceIndex)
 from datetime import datetime
+from utils import get_msg_text
 import logging
 import logging.handlers
 import sys
+import threading
+import textrank
+import near_dupes
+import candidates
 from ts_config import DEBUG
 if "spacy" in SUMMS:
     from sp_summarizer import (SpacyTsSummarizer)
     import lsa
+    import numpy
+    from scipy.sparse import csr_matrix
 if "gensim" in SUMMS:
     from ts_summarizer import (TextRankTsSummarizer)
 
@@ -38,6 +46,56 @@ class TestSummarize(unittest.TestCase):
         self.assertTrue(summ_msg == "@Thu-Sep-9-2015 18:32:08 <@U0EBEC5T5>: <https://a8c.slack.com/archives/elasticsearch/p1441909928000131|because i imagine the places we link people will vary quite a bit with tests>")
 
 
+    def test_message_record(self):
+        """Records carry the normalized fields and format like the raw message"""
+        msg = TestSummarize.test_msgs[1]
+        rec = MessageRecord(msg)
+        self.assertEqual(rec.ts, float(msg['ts']))
+        self.assertEqual(rec.time, ts_to_time(msg['ts']))
+        self.assertEqual(rec.user, u'U0EBEC5T5')
+        self.assertEqual(rec.text, canonicalize(get_msg_text(msg)))
+        self.assertEqual(rec.words, len(rec.text.split()))
+        self.assertEqual(rec.link_id, u'1441909928000131')
+        self.assertEqual(message_records([rec, msg])[0], rec)
+        summ = TsSummarizer()
+        summ.set_channel("elasticsearch")
+        self.assertEqual(summ.tagged_sum(rec), summ.tagged_sum(msg))
+        self.assertEqual(canonicalize(u'Ship it :tada: <http://example.com> ok?  '), u'Ship it   ok?')
+        self.assertEqual(canonicalize(u'v1.2 is out'), u'v12 is out.')
+
+    def test_time_index(self):
+        """Windows are [start, end) slices of the time sorted records"""
+        index = TimeIndex(TestSummarize.test_msgs)
+        ts = sorted(float(msg['ts']) for msg in TestSummarize.test_msgs)
+        start, end = ts[2], ts[-2]
+        window = index.window(start, end)
+        self.assertEqual([rec.ts for rec in window], [t for t in ts if start <= t < end])
+        self.assertEqual(window[0].ts, start)
+        self.assertEqual(window[-1].ts, ts[-3])
+        self.assertEqual([rec.ts for rec in window[:2]], ts[2:4])
+        self.assertEqual(len(index.window(end, start)), 0)
+        hour = index.spec_window({'hours': 1})
+        self.assertEqual(len(hour), len([t for t in ts if t < ts[0] + 3600]))
+        dated = index.spec_window({'start': 'September 10 2015', 'days': 1})
+        self.assertEqual(len(dated), len(ts))
+        self.assertEqual(TsSummarizer().select(index, {'hours': 1})[0], hour[0])
+
+    def test_source_index(self):
+        """Summary sentences map back to their messages by lookup or one search"""
+        texts = [u'The build server deploy failed again today.', u'Lunch?',
+                 u'Rolling back the release until the cache is warm. Then we ship.']
+        recs = message_records([{'ts': u'1441925382.00018{}'.format(i), 'user': u'U1', 'text': t}
+                                for (i, t) in enumerate(texts)])
+        sources = SourceIndex(recs)
+        sources.alias(u'Then we ship.', recs[2])
+        self.assertEqual(sources[u'Lunch?'], recs[1])
+        self.assertEqual(sources.locate([u'Then we ship.', u'Lunch?', u'Lunch?']), [recs[2], recs[1]])
+        self.assertEqual(sources.locate([u'back the release until the cache is warm']), [recs[2]])
+        self.assertEqual(sources.locate([u'deploy failed again today. Lunch? Rolling back']), [recs[0], recs[1], recs[2]])
+        self.assertEqual(sources.locate([u'not in any of them at all here']), [])
+        self.assertEqual(sources.locate([u'back the release until the cache is warm',
+                                         u'build server deploy failed again today'], limit=1), [recs[0]])
+
     def test_gensim_summarization(self):
         """Pass the intervals to summarizer"""
         if "gensim" in SUMMS:
@@ -52,6 +110,83 @@ class TestSummarize(unittest.TestCase):
         else:
             pass
 
+    def test_gensim_windows(self):
+        """The heuristic summaries of every window are reported together before ranking"""
+        if "gensim" in SUMMS:
+            summ = TextRankTsSummarizer()
+            summ.set_channel('elasticsearch')
+            reports = []
+            summ.set_progress(reports.append)
+            end = max(float(msg['ts']) for msg in TestSummarize.test_msgs) + 1
+            specs = [{'minutes': 10, 'size': 2}, {'hours': 2, 'size': 2}, {'days': 1, 'size': 2}]
+            sumry = summ.summarize_windows(TestSummarize.test_msgs, specs, end=end)
+            self.assertEqual(len(reports), 1)
+            self.assertEqual(reports[0].count(u'Summary for last'), 3)
+            self.assertEqual(sumry.count(u'Summary for last'), 3)
+        else:
+            pass
+
+    def test_near_dupes(self):
+        """Near duplicates collapse to their newest message, counting the others"""
+        texts = [u'CPU high on host-12 at 10:03, load 97', u'Deploy of the blog theme finished',
+                 u'CPU high on host-14 at 10:07, load 91', u'Can someone review my cache patch please',
+                 u'Can someone review my cache patch please?? thanks', u'lunch']
+        self.assertEqual(near_dupes.clusters(texts), [[0, 2], [1], [3, 4], [5]])
+        recs = message_records([{'ts': u'1441925382.00018{}'.format(i), 'user': u'U1', 'text': t}
+                                for (i, t) in enumerate(texts)])
+        reps = near_dupes.collapse(recs)
+        self.assertEqual([rec.ts_id for rec in reps], [recs[i].ts_id for i in (1, 2, 4, 5)])
+        self.assertEqual([rec.similar for rec in reps], [0, 1, 1, 0])
+        self.assertEqual(recs[2].similar, 0)
+        self.assertTrue(TsSummarizer().tagged_sum(reps[1]).endswith(u'(+1 similar)'))
+        self.assertEqual(near_dupes.collapse(recs, bands=0), recs)
+        # Exact repeats count too, also once clustered with near duplicates
+        alerts = message_records([{'ts': u'1441925390.00000{}'.format(i), 'user': u'U2', 'text': u'Disk full on db-3 again'}
+                                  for i in range(5)] +
+                                 [{'ts': u'1441925399.000001', 'user': u'U2', 'text': u'Disk full on db-4 again'}])
+        self.assertEqual([(rec.ts_id, rec.similar) for rec in near_dupes.exact(alerts)],
+                         [(u'1441925390.000004', 4), (u'1441925399.000001', 0)])
+        self.assertEqual([(rec.ts_id, rec.similar) for rec in near_dupes.collapse(near_dupes.exact(alerts))],
+                         [(u'1441925399.000001', 5)])
+        spam = [{'ts': u'1441925400.0000{:02d}'.format(i), 'user': u'U3',
+                 'text': u'Reminder: the weekly sync moved to the big room'} for i in range(50)]
+        self.assertTrue(SimpleTsSummarizer().summarize(spam).endswith(u'(+49 similar)'))
+
+    def test_candidates(self):
+        """The heap keeps the most specific messages in time order, per window"""
+        texts = [u'ok ok so yes', u'Elasticsearch shard relocation stalled', u'so yes ok', u'yes so ok ok',
+                 u'Kibana dashboards time out after upgrading the cluster nodes', u'ok so yes']
+        recs = message_records([{'ts': u'14419253{}0.000186'.format(i), 'user': u'U1', 'text': t}
+                                for (i, t) in enumerate(texts)])
+        scores = candidates.bm25_scores(recs)
+        self.assertEqual(candidates.top_k(scores, 2), [1, 4])
+        self.assertEqual(candidates.top_k([1, 3, 3, 2], 2), [1, 2])
+        self.assertEqual(candidates.select(recs, 2), [recs[1], recs[4]])
+        self.assertEqual(candidates.select(recs, None), recs)
+        self.assertEqual(candidates.select_windows(recs, [recs[0].ts, recs[5].ts], 1), [recs[4], recs[5]])
+
+    def test_textrank_graph(self):
+        """The factored power iteration agrees with TextRank on the dense graph"""
+        sents = [u"The deploy failed on the build server.", u"Build server is broken again.",
+                 u"Lunch anyone?", u"I fixed the build server deploy script.", u"Weather is nice."]
+        counts = textrank.term_counts(sents)
+        weights = textrank.bm25_weights(counts)
+        scores, iterations = textrank.pagerank(counts, weights, tol=1e-12, max_iter=1000)
+        numpy = textrank.numpy
+        size = len(sents)
+        graph = counts.dot(weights.T).toarray()
+        numpy.fill_diagonal(graph, 0)
+        out = graph.sum(axis=1)
+        trans = numpy.array([graph[i] / out[i] if out[i] else numpy.full(size, 1.0 / size) for i in range(size)])
+        dense = numpy.full(size, 1.0 / size)
+        for _ in range(iterations):
+            dense = 0.15 / size + 0.85 * trans.T.dot(dense)
+        self.assertTrue(abs(scores - dense).max() < 1e-9)
+        self.assertEqual(textrank.top(scores, 2), [0, 3])
+        snt_scores, msg_scores = textrank.rank(sents, [0, 0, 1, 2, 2])
+        self.assertEqual((len(snt_scores), len(msg_scores)), (5, 3))
+        self.assertEqual(textrank.top(msg_scores, 2), [0, 2])
+
     def test_spacy_summarization(self):
         """Pass the intervals to summarizer"""
         if "spacy" in SUMMS:
@@ -69,6 +204,122 @@ class TestSummarize(unittest.TestCase):
         else:
             pass
 
+    def test_spacy_parses_once(self):
+        """Each message is parsed once and the joined text never is"""
+        if "spacy" in SUMMS:
+            lsa_summ = lsa.LsaSummarizer(cache=False)
+            nlp = lsa_summ.nlp
+            parsed = []
+            def counting_nlp(txt, *args, **kwargs):
+                parsed.append(txt)
+                return nlp(txt, *args, **kwargs)
+            counting_nlp.vocab = nlp.vocab
+            lsa_summ.nlp = counting_nlp
+            summ = SpacyTsSummarizer()
+            summ.set_summarizer(lsa_summ)
+            summ.set_channel('elasticsearch')
+            sumry = summ.summarize(TestSummarize.test_msgs)
+            self.assertTrue(len(sumry) > 1)
+            self.assertTrue(len(parsed) > 0)
+            self.assertEqual(len(parsed), len(set(parsed)))
+        else:
+            pass
+
+    def test_lsa_batched_parse(self):
+        """Batched parsing yields the same docs, in order, as one at a time"""
+        if "spacy" in SUMMS:
+            lsa_summ = lsa.LsaSummarizer(workers=2, min_batch=1, batch_size=4)
+            texts = [get_msg_text(msg) for msg in TestSummarize.test_msgs]
+            piped = [doc.text for doc in lsa_summ.parse(texts)]
+            lsa_summ.min_batch = len(texts) + 1
+            single = [doc.text for doc in lsa_summ.parse(texts)]
+            self.assertEqual(piped, single)
+        else:
+            pass
+
+    def test_lsa_concurrent_calls(self):
+        """One summarizer serves many threads with the same results as serially"""
+        if "spacy" in SUMMS:
+            lsa_summ = lsa.LsaSummarizer(cache=False)
+            with io.open('./data/test-events-elastic.json', encoding='utf-8') as jf:
+                other_msgs = json.load(jf)['messages']
+            inputs = [TestSummarize.test_msgs, other_msgs] * 8
+            def run(msgs):
+                summ = SpacyTsSummarizer()
+                summ.set_summarizer(lsa_summ)
+                summ.set_channel('elasticsearch')
+                return summ.summarize(msgs)
+            expected = [run(msgs) for msgs in inputs[:2]]
+            results = [None] * len(inputs)
+            def worker(i):
+                results[i] = run(inputs[i])
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(inputs))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for (i, result) in enumerate(results):
+                self.assertEqual(result, expected[i % 2])
+        else:
+            pass
+
+    def test_lsa_truncated_svd(self):
+        """The sparse engine agrees with the dense SVD on the top dimensions"""
+        if "spacy" in SUMMS:
+            lsa_summ = lsa.LsaSummarizer(max_dimensions=10)
+            rng = numpy.random.RandomState(7)
+            counts = rng.poisson(0.3, size=(60, 40)).astype('float64')
+            sigma, v = lsa_summ._singular_values(csr_matrix(counts))
+            lsa_summ.DENSE_LIMIT = 0
+            t_sigma, t_v = lsa_summ._singular_values(csr_matrix(counts))
+            self.assertEqual(len(t_sigma), 10)
+            self.assertTrue(numpy.allclose(sigma[:10], t_sigma))
+            ranks = lsa_summ._compute_ranks(sigma[:10], v[:10])
+            t_ranks = lsa_summ._compute_ranks(t_sigma, t_v)
+            self.assertTrue(numpy.allclose(ranks, t_ranks))
+        else:
+            pass
+
+    def test_lsa_batch_ranks(self):
+        """Stacked ranking matches ranking each document on its own"""
+        if "spacy" in SUMMS:
+            rng = numpy.random.RandomState(3)
+            batch = [rng.poisson(0.2, size=(30 - i, 12 + i)).astype('float64') for i in range(4)]
+            for matrix, ranks in zip(batch, lsa.batch_ranks(batch)):
+                tf = lsa.compute_term_frequency(matrix)
+                u, sigma, v = numpy.linalg.svd(tf, full_matrices=False)
+                self.assertTrue(numpy.allclose(lsa.compute_ranks(sigma, v), ranks))
+        else:
+            pass
+
+    def test_spacy_windows(self):
+        """Windows share one parse; the full window matches a plain LSA call"""
+        if "spacy" in SUMMS:
+            lsa_summ = lsa.LsaSummarizer(cache=False)
+            parsed = []
+            parse = lsa_summ.parse
+            def counting_parse(texts, keys=None):
+                texts = list(texts)
+                parsed.extend(texts)
+                return parse(texts, keys)
+            lsa_summ.parse = counting_parse
+            summ = SpacyTsSummarizer()
+            summ.set_summarizer(lsa_summ)
+            summ.set_channel('elasticsearch')
+            end = max(float(msg['ts']) for msg in TestSummarize.test_msgs) + 1
+            specs = [{'minutes': 10, 'size': 2}, {'hours': 2, 'size': 2}, {'days': 1, 'size': 2}]
+            sumry = summ.summarize_windows(TestSummarize.test_msgs, specs, end=end)
+            self.assertEqual(sumry.count(u'Summary for last'), 3)
+            self.assertEqual(len(parsed), len(set(parsed)))
+            docs = list(lsa_summ.parse(set(parsed)))
+            spans = [max(doc.sents, key=len) for doc in docs]
+            spans = dict((span.text, span) for span in spans).values()
+            users = dict((span.text, u'') for span in spans)
+            full = lsa_summ.summarize_windows(spans, users, [(range(len(spans)), 3)])[0]
+            self.assertEqual(full, lsa_summ(spans, 3, users))
+        else:
+            pass
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+TextRank over a sparse BM25 similarity graph. Sentences are tokenized
+once into a term count matrix; the message level graph sums the rows of
+each message's sentences, so both granularities share one pass over the
+text. The graph W = Q * D^T (query counts against BM25 document weights)
+is never built: the power iteration multiplies by its two sparse factors,
+which keeps the cost linear in the number of tokens.
+"""
+from __future__ import absolute_import
+from __future__ import division, print_function, unicode_literals
+
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from scipy.sparse import csr_matrix
+except ImportError:
+    csr_matrix = None
+
+try:
+    from gensim.parsing.preprocessing import STOPWORDS
+    from gensim.parsing.porter import PorterStemmer
+except ImportError:
+    STOPWORDS = frozenset()
+    PorterStemmer = None
+
+# BM25 parameters of gensim's summarizer
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+DAMPING = 0.85
+TOLERANCE = 1e-6
+MAX_ITERATIONS = 100
+
+
+class Tokenizer(object):
+    """Lower cased stems of the words of three or more letters, stop words dropped"""
+    words = re.compile(r'[^\W\d_]{3,}', re.UNICODE)
+
+    def __init__(self, stop_words=STOPWORDS):
+        self.stop_words = stop_words
+        self.stemmer = PorterStemmer() if PorterStemmer else None
+        # Every distinct word is stemmed once
+        self.stems = {}
+
+    def __call__(self, text):
+        tokens = []
+        for word in Tokenizer.words.findall(text.lower()):
+            if word in self.stop_words:
+                continue
+            stem = self.stems.get(word)
+            if stem is None:
+                stem = self.stems[word] = self.stemmer.stem(word) if self.stemmer else word
+            tokens.append(stem)
+        return tokens
+
+
+def term_counts(texts, tokenize=None):
+    """Sparse texts x terms matrix of token counts"""
+    tokenize = tokenize or Tokenizer()
+    vocabulary = {}
+    rows, cols = [], []
+    for (i, text) in enumerate(texts):
+        for token in tokenize(text):
+            rows.append(i)
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+    data = numpy.ones(len(rows))
+    # Duplicate (row, term) entries are summed into counts
+    return csr_matrix((data, (rows, cols)), shape=(len(texts), max(len(vocabulary), 1)))
+
+
+def bm25_weights(counts):
+    """BM25 weight of each term in each row, the rows being the documents"""
+    counts = counts.tocsr()
+    docs = counts.shape[0]
+    lengths = numpy.asarray(counts.sum(axis=1)).ravel()
+    avgdl = lengths.mean() if docs and lengths.mean() > 0 else 1.0
+    df = numpy.bincount(counts.indices, minlength=counts.shape[1])
+    idf = numpy.log(docs - df + 0.5) - numpy.log(df + 0.5)
+    # Terms in more than half of the documents get a small positive weight
+    floor = EPSILON * abs(idf[df > 0].mean()) if (df > 0).any() else EPSILON
+    idf = numpy.where(idf < 0, floor, idf)
+    row_of = numpy.repeat(numpy.arange(docs), numpy.diff(counts.indptr))
+    freq = counts.data
+    data = idf[counts.indices] * freq * (K1 + 1) / (freq + K1 * (1 - B + B * lengths[row_of] / avgdl))
+    return csr_matrix((data, counts.indices, counts.indptr), shape=counts.shape)
+
+
+def pagerank(counts, weights=None, damping=DAMPING, tol=TOLERANCE, max_iter=MAX_ITERATIONS):
+    """
+    Scores of the rows of `counts` over the graph Q * D^T without self
+    loops, Q being the counts and D their BM25 `weights`. Iterates until the
+    scores move less than `tol` (L1). Returns the scores and the iterations.
+    """
+    query = counts.tocsr()
+    docs = (bm25_weights(query) if weights is None else weights).tocsr()
+    n = query.shape[0]
+    if n == 0:
+        return numpy.zeros(0), 0
+    query_t = query.T.tocsr()
+    self_loops = numpy.asarray(query.multiply(docs).sum(axis=1)).ravel()
+    total = query.dot(numpy.asarray(docs.sum(axis=0)).ravel())
+    out = total - self_loops
+    # Rounding leaves tiny out weights on rows only similar to themselves
+    dangling = out <= 1e-9 * total
+    inv_out = numpy.where(dangling, 0.0, 1.0 / numpy.where(dangling, 1.0, out))
+    scores = numpy.full(n, 1.0 / n)
+    for iteration in range(1, max_iter + 1):
+        share = scores * inv_out
+        flow = docs.dot(query_t.dot(share)) - self_loops * share
+        new = (1 - damping) / n + damping * (numpy.maximum(flow, 0) + scores[dangling].sum() / n)
+        delta = numpy.abs(new - scores).sum()
+        scores = new
+        if delta < tol:
+            break
+    return scores, iteration
+
+
+def rank(sentences, owners, tokenize=None, damping=DAMPING, tol=TOLERANCE, max_iter=MAX_ITERATIONS):
+    """
+    TextRank scores of `sentences` and of the messages they belong to,
+    `owners[i]` being the message index of sentence i. Returns the sentence
+    and the message scores.
+    """
+    counts = term_counts(sentences, tokenize)
+    owners = numpy.asarray(owners, dtype=int)
+    messages = owners.max() + 1 if len(owners) else 0
+    membership = csr_matrix((numpy.ones(len(owners)), (owners, numpy.arange(len(owners)))),
+                            shape=(messages, len(owners)))
+    sentence_scores, _ = pagerank(counts, damping=damping, tol=tol, max_iter=max_iter)
+    message_scores, _ = pagerank(membership.dot(counts), damping=damping, tol=tol, max_iter=max_iter)
+    return sentence_scores, message_scores
+
+
+def top(scores, count):
+    """Indices of the `count` best scores, in their original order"""
+    best = numpy.argsort(-numpy.asarray(scores), kind='mergesort')[:count]
+    return sorted(best.tolist())
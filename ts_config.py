@@ -1,4 +1,6 @@
-SUMMARY_INTERVALS = [{'days': 5, 'size': 2}, ]
+# Windows of a multi window summary ("/summary intervals"), each one the
+# given duration up to now
+SUMMARY_INTERVALS = [{'minutes': 10, 'size': 2}, {'hours': 12, 'size': 2}, {'days': 5, 'size': 2}]
 TS_DEBUG = True
 TS_LOG = "ts_summ.log"
 DEBUG=True
@@ -7,3 +9,71 @@ TEST_JSON="./data/test-events-elastic.json"
 SUMMS=["spacy"]
 
 
+# Messages are parsed in batches of PARSE_BATCH_SIZE by PARSE_WORKERS workers,
+# inputs smaller than PARSE_MIN_BATCH are parsed in process one at a time
+PARSE_BATCH_SIZE=500
+PARSE_WORKERS=4
+PARSE_MIN_BATCH=50
+# Parsed messages are cached in memory (PARSE_CACHE_SIZE entries) and on disk
+# under PARSE_CACHE_DIR up to PARSE_CACHE_BYTES, set the directory to None to
+# keep the cache in memory only
+PARSE_CACHE_SIZE=20000
+PARSE_CACHE_DIR="./parse_cache"
+PARSE_CACHE_BYTES=256*1024*1024
+# Channel history is kept in the SQLite file MESSAGE_STORE (None disables it),
+# the last STORE_RECONCILE_SECONDS of stored history are refetched for edits
+MESSAGE_STORE="./message_store.db"
+STORE_RECONCILE_SECONDS=3600
+# When DEFERRED is set and Slack sends a response_url, /slack answers at once
+# and DEFERRED_WORKERS threads post the summary later; at most DEFERRED_QUEUE
+# jobs wait and each gets DEFERRED_TIMEOUT seconds. Jobs past their timeout
+# keep running, at most DEFERRED_RUNNERS jobs are running in all
+DEFERRED=True
+DEFERRED_WORKERS=4
+DEFERRED_QUEUE=32
+DEFERRED_TIMEOUT=120
+DEFERRED_RUNNERS=8
+# Number of forked gunicorn workers sharing the preloaded model and their timeout
+SERVE_WORKERS=4
+SERVE_TIMEOUT=180
+# Unix sockets of standalone NLP services (nlp_service.py), when set the web
+# tier does not load the engines itself
+NLP_SOCKETS=[]
+NLP_TIMEOUT=120
+# Base URL of the Slack Web API, e.g. a local fake_slack.py server for load tests
+SLACK_API_URL=None
+# A PROFILE_SAMPLE_RATE fraction of summary requests runs under cProfile, the
+# profiles of those slower than PROFILE_SLOW_SECONDS are saved in PROFILE_DIR
+PROFILE_SAMPLE_RATE=0.0
+PROFILE_SLOW_SECONDS=10
+PROFILE_DIR="./profiles"
+# Log records wait in a queue of LOG_QUEUE_SIZE for the writer thread, logged
+# payloads are cut to LOG_PAYLOAD_CHARS and a LOG_VERBOSE_SAMPLE fraction of
+# the verbose records is kept
+LOG_QUEUE_SIZE=10000
+LOG_PAYLOAD_CHARS=500
+LOG_VERBOSE_SAMPLE=0.1
+# Up to SUMMARY_CACHE_SIZE finished summaries are reused for SUMMARY_CACHE_TTL
+# seconds by identical requests while no new message arrives, 0 disables it
+SUMMARY_CACHE_SIZE=256
+SUMMARY_CACHE_TTL=300
+# Messages whose word shingles have an estimated Jaccard similarity of at
+# least NEAR_DUP_THRESHOLD are ranked as one, candidates are found in
+# NEAR_DUP_BANDS LSH bands of NEAR_DUP_ROWS MinHash rows, 0 bands disables it
+NEAR_DUP_THRESHOLD=0.7
+NEAR_DUP_BANDS=10
+NEAR_DUP_ROWS=3
+# Only the CANDIDATE_LIMIT most informative messages (BM25 against the
+# fetched history) are parsed and ranked, None keeps all of them
+CANDIDATE_LIMIT=400
+# Summaries are planned to be ready SUMMARY_DEADLINE seconds after the
+# request arrives (keep it below DEFERRED_TIMEOUT). PLAN_COSTS estimates each
+# plan as (seconds, per message, per thousand characters parsed) and is
+# refined by measured times; LSA over fewer than PLAN_MIN_CANDIDATES
+# candidates is not planned. At most PLAN_RUNNERS planned engine runs, late
+# ones included, are alive at once; beyond that the longest messages are sent
+SUMMARY_DEADLINE=20
+PLAN_RUNNERS=8
+PLAN_COSTS={'simple': (0.0, 0.00005, 0.0), 'textrank': (0.05, 0.0001, 0.002),
+            'lsa_limited': (0.2, 0.0001, 0.02), 'lsa': (0.2, 0.0001, 0.02)}
+PLAN_MIN_CANDIDATES=50
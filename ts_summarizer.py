@@ -1,38 +1,33 @@
 # -*- coding: utf-8 -*-
 from collections import namedtuple
 from datetime import (timedelta, datetime)
+from operator import attrgetter
 import re
 import logging
-import logging.handlers
 import sys
 import json
 import io
-import lsa
-import utils
-import base_summarizer
-import compat
-from gensim.summarization import summarize as gs_sumrz
+import time
 from gensim.summarization.textcleaner import split_sentences
 from gensim.models.word2vec import LineSentence
-from ts_config import TS_DEBUG, TS_LOG
+from log_queue import capped, VERBOSE
 import glob
-from interval_summarizer import (IntervalSpec, TsSummarizer,
-                                 ts_to_time)
+from interval_summarizer import (IntervalSpec, TsSummarizer, TimeIndex,
+                                 ts_to_time, canonicalize as interval_canonicalize)
 from utils import get_msg_text
+import metrics
+import textrank
+from near_dupes import collapse, exact
+from candidates import select
 logging.basicConfig(level=logging.INFO)
+# Longer messages are cut to this many words before ranking
+MAX_WORDS = 100
 
 class TextRankTsSummarizer(TsSummarizer):
 
     def __init__(self, ):
         TsSummarizer.__init__(self, )
-        log_level = logging.DEBUG if TS_DEBUG else logging.INFO
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh = logging.handlers.RotatingFileHandler('./text_rank_'+TS_LOG, mode='a', encoding='utf-8', maxBytes=1000000, backupCount=5)
-        fh.setLevel(log_level)
-        fh.setFormatter(formatter)
         self.logger = logging.getLogger('ts_summarizer')
-        self.logger.handlers = []
-        self.logger.addHandler(fh)
 
     def set_summarizer(self, val):
         pass
@@ -49,60 +44,81 @@ class TextRankTsSummarizer(TsSummarizer):
         txt = range_spec['txt'] if range_spec else u'Summary is'
         size = range_spec['size'] if range_spec and 'size' in range_spec else 3
         summ = txt + u' '
-        #limit canonical dictionary to top 200 docs
-        can_dict = {canonicalize(get_msg_text(msg)) : msg for msg in msgs}
-        top_keys = sorted(can_dict.keys(), key=lambda x: len(x.split()), reverse=True)[:300]
-        can_dict = {key: can_dict[key] for key in top_keys}
+        records = self.select(msgs, range_spec)
+        can_dict = {rank_text(rec) : rec for rec in exact(records, rank_text)}
         self.logger.info("Length of can_dict is %s", len(can_dict))
-        simple_sum = u'\n'.join([self.tagged_sum(can_dict[ss]) for ss in sorted(can_dict.keys(), key=lambda x: len(x.split()), reverse=True)[:3]])
+        simple_sum = self._longest_sum(can_dict.values())
         # If the number of messages or vocabulary is too low, just look for a
         # promising set of messages
-        if len(msgs) < 11 or len(can_dict) < 11:
+        if len(records) < 11 or len(can_dict) < 11:
             #return the longest
             self.logger.warn("Too few messages for NLP.")
             summ += simple_sum
         else:
-            max_sents = {}
-            for (txt, msg) in can_dict.items():
-                if len(txt.split()) > 3:
-                    #Use the same splitting that gensim does
-                    for snt in split_sentences(txt):
-                        if len(snt.split()) > 100:
-                            snt = u' '.join(snt.split()[:100])
-                        max_sents[snt] = msg
-            ratio = (size * 2)/ float(len(max_sents.keys()))
-            #ratio = 0.3
-            sent1 = u' '.join(can_dict.keys())
-            sent2 = u' '.join(max_sents.keys())
-            gn_sum = gs_sumrz(sent1, ratio=ratio, split=True)[:size]
-            mx_sum = gs_sumrz(sent2, ratio=ratio, split=True)[:size]
-            self.logger.info("Gensim sum %s", gn_sum)
-            gs_summ = u'\n'.join([self.tagged_sum(can_dict[ss] if ss in can_dict else max_sents[ss]) for ss in gn_sum if len(ss) > 1 and (ss in max_sents or ss in can_dict)])
-            for ss in mx_sum:
-                if ss not in max_sents and ss not in can_dict and len(ss.split()) > 5:
-                    self.logger.info("Searching for: %s", ss)
-                    for (ky, msg) in max_sents.items():
-                        if ss in ky or (len(ky.split()) > 10 and ky in ss):
-                            gs_summ += u'\n' + self.tagged_sum(msg)
+            self.report_progress(summ + simple_sum)
+            cands = select(collapse(sorted(can_dict.values(), key=attrgetter('ts'))), self.candidate_limit)
+            sentences = []
+            owners = []
+            for (i, rec) in enumerate(cands):
+                #Use the same splitting that gensim does
+                for snt in split_sentences(rank_text(rec)):
+                    sentences.append(snt)
+                    owners.append(i)
+            with metrics.timed('textrank'):
+                snt_scores, msg_scores = textrank.rank(sentences, owners)
+            # The best messages in time order, then those holding one of the
+            # best sentences without ranking as a whole
+            gn_sum = textrank.top(msg_scores, size)
+            mx_sum = textrank.top(snt_scores, size)
+            self.logger.info("TextRank sum %s", capped([rank_text(cands[i]) for i in gn_sum]))
+            with metrics.timed('format'):
+                gs_summ = u'\n'.join([self.tagged_sum(cands[i]) for i in gn_sum])
+                for i in sorted(set(owners[j] for j in mx_sum) - set(gn_sum)):
+                    gs_summ += u'\n' + self.tagged_sum(cands[i])
             if len(gn_sum) > 1:
                 summ += gs_summ
             else:
                 self.logger.warn("NLP Summarizer produced null output %s", gs_summ)
                 summ += simple_sum
-        self.logger.info("Summary for segment %s is %s", msgs, summ) 
+        self.logger.info("Summary for segment of %s messages is %s", len(records), capped(summ))
         return summ
 
+    def summarize_windows(self, msgs, specs, end=None):
+        """
+        The heuristic summaries of all the windows are reported together
+        before any window is ranked, so a run stopped at its deadline
+        still covers every window.
+        """
+        index = msgs if isinstance(msgs, TimeIndex) else TimeIndex(msgs)
+        end = time.time() if end is None else end
+        windows = [index.last_window(spec, end) for spec in specs]
+        self.report_progress(u'\n'.join(self._section(spec, window, self._longest_sum(window) if len(window) else u'')
+                                        for (spec, window) in zip(specs, windows)))
+        progress, self.progress = self.progress, None
+        try:
+            return TsSummarizer.summarize_windows(self, index, specs, end)
+        finally:
+            self.progress = progress
+
+    def _longest_sum(self, records):
+        """The three longest distinct messages, longest first"""
+        top_recs = sorted(exact(records, rank_text), key=lambda rec: min(rec.words, MAX_WORDS), reverse=True)
+        with metrics.timed('format'):
+            return u'\n'.join([self.tagged_sum(rec) for rec in top_recs[:3]])
+
     def parify_text(self, msg_segment):
         ptext = u'. '.join([TextRankTsSummarizer.flrg.sub(u'', get_msg_text(msg)) for msg in msg_segment])
-        self.logger.debug("Parified text is %s", ptext)
+        self.logger.debug("Parified text is %s", capped(ptext))
         return ptext
 
 def canonicalize(txt):
     """Change the messages so that each ends with punctation"""
-    ntxt = TsSummarizer.flrg.sub(u'', txt)
-    ntxt =  ntxt.strip() if re.match(r'.*[\.\?\!]\s*$', ntxt) else u'{}.'.format(ntxt.strip())
-    return ntxt if len(ntxt.split()) < 100 else u' '.join(ntxt.split()[:100])
-    #return ntxt if re.match(r'.*[\.\?]$', ntxt) else u'{}.'.format(ntxt)
+    ntxt = interval_canonicalize(txt)
+    return ntxt if len(ntxt.split()) < MAX_WORDS else u' '.join(ntxt.split()[:MAX_WORDS])
+
+def rank_text(rec):
+    """`canonicalize` of a message record, reusing its word count"""
+    return rec.text if rec.words < MAX_WORDS else u' '.join(rec.text.split()[:MAX_WORDS])
 
 def main():
     asd = [{'minutes': 30, 'txt' : u'Summary for first 30 minutes:\n', 'size' : 2}, {'hours':36, 'txt' : u'Summary for next 36 hours:\n', 'size': 3}]
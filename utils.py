@@ -3,6 +3,10 @@
 from __future__ import absolute_import
 from __future__ import division, print_function, unicode_literals
 
+import os
+import resource
+import time
+
 class ItemsCount(object):
     def __init__(self, value):
         self._value = value
@@ -46,4 +50,12 @@ def get_msg_text(msg):
             if len(max_text) > 0:
                 return max_text
     return u""
-            
+
+def process_report(started):
+    """Pid, seconds since `started` and resident set size (KB) of this process"""
+    try:
+        with open('/proc/self/statm') as statm:
+            rss_kb = int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError):
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'pid': os.getpid(), 'uptime': round(time.time() - started, 3), 'rss_kb': rss_kb}